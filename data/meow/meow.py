@@ -4,12 +4,23 @@
 # http://opensource.org/licenses/MIT>. This file may not be copied, modified, or
 # distributed except according to those terms.
 
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from shutil import rmtree
+from typing import TypeVar
 
 import polars as pl
 
 WD = Path(__file__).parent
 DATA_OLD = WD.parent / "data_final"
+HIVE_DIR = WD / "parquet"
+
+FrameT = TypeVar("FrameT", pl.DataFrame, pl.LazyFrame)
+
+EXPORT_HIVE = False  # Also write each output as a Hive-partitioned Parquet dataset
+MAX_WORKERS = None  # Defaults to the executor's own thread count
+STREAMING = False  # Sink every output from the lazy plan instead of collecting it
 
 POL_PROV_RENAMES = {
     "Municipality": "municipality",
@@ -102,12 +113,23 @@ BGT_REVS_COLS = [
     "total_rev",
 ]
 
+MONETARY_SUFFIXES = ("_base", "_rev", "_exp")
+
+# Checked in order, so compound suffixes must precede the suffixes they end with
+DERIVED_SUFFIXES: dict[str, Callable[[pl.Expr], pl.Expr]] = {
+    "_capita_adj": lambda c: (
+        c * pl.col("cpi_deflator_2002") / pl.col("latest_census_pop")
+    ),
+    "_capita": lambda c: c / pl.col("latest_census_pop"),
+    "_adj": lambda c: c * pl.col("cpi_deflator_2002"),
+}
+
 
-def main() -> None:
-    df_cpi_defl_2002 = pl.read_csv(WD / "cpi_defl_2002.csv")
+def main(streaming: bool = STREAMING) -> None:
+    lf_cpi_defl_2002 = pl.scan_csv(WD / "cpi_defl_2002.csv")
 
-    df_pol_prov_2024 = (
-        pl.read_excel(DATA_OLD / "data_pol_prov.xlsx")
+    lf_pol_prov_2024 = (
+        pl.scan_parquet(DATA_OLD / "data_pol_prov.parquet")
         .rename(POL_PROV_RENAMES)
         .with_columns(
             pl.col("police_provider_2024").str.replace("Municipal", "municipal")
@@ -116,36 +138,36 @@ def main() -> None:
         .sort("municipality")
     )
 
-    df_cmp_demo = (
-        pl.read_excel(DATA_OLD / "data_cmp_data.xlsx")
+    lf_cmp_demo = (
+        pl.scan_parquet(DATA_OLD / "data_cmp_data.parquet")
         .rename(CMP_DEMO_RENAMES)
         .select(list(CMP_DEMO_RENAMES.values()))
     )
 
-    df_tax_base = (
-        pl.read_excel(DATA_OLD / "data_tax_base.xlsx")
+    lf_tax_base = (
+        pl.scan_parquet(DATA_OLD / "data_tax_base.parquet")
         .select(["Year", "Municipality", "Total Tax Base for Rate"])
         .rename(TAX_BASE_RENAMES)
     )
 
-    df_bgt_exps = (
-        pl.read_excel(DATA_OLD / "data_bgt_exps.xlsx")
+    lf_bgt_exps = (
+        pl.scan_parquet(DATA_OLD / "data_bgt_exps.parquet")
         .rename(BGT_EXPS_RENAMES)
         .select(BGT_EXPS_COLS)
     )
 
-    df_bgt_revs = (
-        pl.read_excel(DATA_OLD / "data_bgt_revs.xlsx")
+    lf_bgt_revs = (
+        pl.scan_parquet(DATA_OLD / "data_bgt_revs.parquet")
         .rename(BGT_REVS_RENAMES)
         .select(BGT_REVS_COLS)
     )
 
-    df_full = add_derived_cols(
-        df_cmp_demo.join(df_tax_base, on=["year", "municipality"], how="left")
-        .join(df_bgt_exps, on=["year", "municipality"], how="left")
-        .join(df_bgt_revs, on=["year", "municipality"], how="left")
-        .join(df_cpi_defl_2002, on="year", how="left")
-        .join(df_pol_prov_2024, on="municipality", how="left")
+    lf_full = (
+        lf_cmp_demo.join(lf_tax_base, on=["year", "municipality"], how="left")
+        .join(lf_bgt_exps, on=["year", "municipality"], how="left")
+        .join(lf_bgt_revs, on=["year", "municipality"], how="left")
+        .join(lf_cpi_defl_2002, on="year", how="left")
+        .join(lf_pol_prov_2024, on="municipality", how="left")
     )
 
     main_cols = expand_col_list(
@@ -161,44 +183,118 @@ def main() -> None:
         "_base",
     )
 
-    year_min = df_full["year"].min()
-    year_max = df_full["year"].max()
-    years = range(year_min, year_max + 1)
+    frames = {
+        "main": select_derived(lf_full, main_cols),
+        "cmp_demo": select_derived(lf_full, expand_col_list(CMP_DEMO_COLS, "_base")),
+        "bgt_exps": select_derived(lf_full, expand_col_list(BGT_EXPS_COLS, "_exp")),
+        "bgt_revs": select_derived(lf_full, expand_col_list(BGT_REVS_COLS, "_rev")),
+    }
+    frames = {name: lf.sort("year", "municipality") for name, lf in frames.items()}
 
-    df_main = df_full.select(main_cols).sort("year", "municipality")
-    df_cmp_demo_out = df_full.select(expand_col_list(CMP_DEMO_COLS, "_base")).sort(
-        "year", "municipality"
-    )
-    df_bgt_exps_out = df_full.select(expand_col_list(BGT_EXPS_COLS, "_exp")).sort(
-        "year", "municipality"
-    )
-    df_bgt_revs_out = df_full.select(expand_col_list(BGT_REVS_COLS, "_rev")).sort(
-        "year", "municipality"
-    )
+    if streaming:
+        sink_outputs(lf_pol_prov_2024, frames, WD)
+        return
+
+    df_pol_prov_2024, *dfs = pl.collect_all([lf_pol_prov_2024, *frames.values()])
+    frames_eager = dict(zip(frames, dfs))
 
-    df_main.write_csv(WD / "main.csv")
     df_pol_prov_2024.write_csv(WD / "pol_prov_2024.csv")
-    df_cmp_demo_out.write_csv(WD / "cmp_demo.csv")
-    df_bgt_exps_out.write_csv(WD / "bgt_exps.csv")
-    df_bgt_revs_out.write_csv(WD / "bgt_revs.csv")
 
-    for year in years:
-        year_dir = WD / str(year)
-        year_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in frames_eager.items():
+        df.write_csv(WD / f"{name}.csv")
 
-        df_main.filter(pl.col("year") == year).drop("year").write_csv(
-            year_dir / f"main_{year}.csv"
-        )
-        df_cmp_demo_out.filter(pl.col("year") == year).drop("year").write_csv(
-            year_dir / f"cmp_demo_{year}.csv"
-        )
-        df_bgt_exps_out.filter(pl.col("year") == year).drop("year").write_csv(
-            year_dir / f"bgt_exps_{year}.csv"
-        )
-        df_bgt_revs_out.filter(pl.col("year") == year).drop("year").write_csv(
-            year_dir / f"bgt_revs_{year}.csv"
+    df_main = frames_eager["main"]
+    years = range(df_main["year"].min(), df_main["year"].max() + 1)
+
+    write_year_csvs(frames_eager, years, WD, MAX_WORKERS)
+
+    if EXPORT_HIVE:
+        write_hive_parquet(frames_eager, HIVE_DIR)
+
+
+def sink_outputs(
+    lf_pol_prov_2024: pl.LazyFrame, frames: dict[str, pl.LazyFrame], dst_dir: Path
+) -> None:
+    sinks = [lf_pol_prov_2024.sink_csv(dst_dir / "pol_prov_2024.csv", lazy=True)]
+
+    for name, lf in frames.items():
+        sinks.append(lf.sink_csv(dst_dir / f"{name}.csv", lazy=True))
+        sinks.append(
+            lf.sink_csv(
+                pl.PartitionBy(
+                    dst_dir,
+                    key="year",
+                    include_key=False,
+                    file_path_provider=lambda args, name=name: get_year_csv(
+                        name, args.partition_keys.item(0, "year")
+                    ),
+                ),
+                mkdir=True,
+                lazy=True,
+            )
         )
 
+        if EXPORT_HIVE:
+            if (HIVE_DIR / name).exists():
+                rmtree(HIVE_DIR / name)
+
+            sinks.append(
+                lf.sink_parquet(
+                    pl.PartitionBy(HIVE_DIR / name, key="year"), mkdir=True, lazy=True
+                )
+            )
+
+    # Shared subplans such as the joined panel are executed once across sinks
+    pl.collect_all(sinks, engine="streaming")
+
+
+def get_year_csv(name: str, year: int) -> str:
+    return f"{year}/{name}_{year}.csv"
+
+
+def write_year_csvs(
+    frames: dict[str, pl.DataFrame],
+    years: range,
+    dst_dir: Path,
+    max_workers: int | None = None,
+) -> None:
+    for year in years:
+        (dst_dir / str(year)).mkdir(parents=True, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(
+                df_year.drop("year").write_csv,
+                dst_dir / get_year_csv(name, year),
+            )
+            for name, df in frames.items()
+            for year, df_year in partition_by_year(df, years).items()
+        ]
+
+    for future in futures:
+        future.result()
+
+
+def partition_by_year(df: pl.DataFrame, years: range) -> dict[int, pl.DataFrame]:
+    parts = {
+        year: df_year
+        for (year,), df_year in df.partition_by(
+            "year", as_dict=True, maintain_order=True
+        ).items()
+    }
+
+    return {year: parts.get(year, df.clear()) for year in years}
+
+
+def write_hive_parquet(frames: dict[str, pl.DataFrame], dst_dir: Path) -> None:
+    for name, df in frames.items():
+        dst = dst_dir / name
+
+        if dst.exists():
+            rmtree(dst)
+
+        df.write_parquet(dst, partition_by="year")
+
 
 def expand_col_list(cols: list[str], suffix: str) -> list[str]:
     cols_new: list[str] = []
@@ -212,25 +308,23 @@ def expand_col_list(cols: list[str], suffix: str) -> list[str]:
     return cols_new
 
 
-def add_derived_cols(df: pl.DataFrame) -> pl.DataFrame:
-    cols_monetary = [c for c in df.columns if c.endswith(("_base", "_rev", "_exp"))]
-
-    return df.with_columns(
-        *[
-            (pl.col(c) * pl.col("cpi_deflator_2002")).alias(f"{c}_adj")
-            for c in cols_monetary
-        ],
-        *[
-            (pl.col(c) / pl.col("latest_census_pop")).alias(f"{c}_capita")
-            for c in cols_monetary
-        ],
-        *[
-            (
-                pl.col(c) * pl.col("cpi_deflator_2002") / pl.col("latest_census_pop")
-            ).alias(f"{c}_capita_adj")
-            for c in cols_monetary
-        ],
-    )
+def select_derived(df: FrameT, cols: list[str]) -> FrameT:
+    names = df.collect_schema().names()
+
+    return df.select(get_derived_expr(c, names) for c in cols)
+
+
+def get_derived_expr(col: str, names: list[str]) -> pl.Expr:
+    if col in names:
+        return pl.col(col)
+
+    for suffix, derive in DERIVED_SUFFIXES.items():
+        base = col.removesuffix(suffix)
+
+        if base != col and base.endswith(MONETARY_SUFFIXES) and base in names:
+            return derive(pl.col(base)).alias(col)
+
+    raise ValueError(f"Column `{col}` is neither present nor derivable.")
 
 
 if __name__ == "__main__":
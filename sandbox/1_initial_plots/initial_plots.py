@@ -7,6 +7,7 @@
 
 # %%
 from pathlib import Path
+from sys import path
 
 import matplotlib.pyplot as plt
 import polars as pl
@@ -15,14 +16,20 @@ import seaborn as sns
 
 # %%
 WD = Path(__file__).parent
-SRC = WD.parent.parent / "data" / "data_final" / "data_master.xlsx"
+path.append(str(WD.parent))
+
+from data_access import load_data  # noqa: E402
+from groups import aggregate_trends  # noqa: E402
+
+
+# %%
 PLOTS_DIR = WD / "plots"
 DIVIDE_YEAR = 2012
 
 
 # %%
 def main() -> None:
-    df = pl.read_excel(SRC).select(
+    df = load_data().select(
         [
             "Year",
             "PolExpCapita",
@@ -32,58 +39,26 @@ def main() -> None:
         ]
     )
 
+    df_trends = aggregate_trends(
+        df, ["PolExpCapita", "AvgTaxRate"], ["Provider_PPSA"], "LatestCensusPop"
+    )
+
     PLOTS_DIR.mkdir(parents=True, exist_ok=True)
 
-    plot_polexpcapita(df)
-    plot_avgtaxrate(df)
+    plot_polexpcapita(df_trends)
+    plot_avgtaxrate(df_trends)
 
 
 # %%
-def plot_polexpcapita(df: pl.DataFrame) -> None:
-    df_weighted = (
-        df.group_by("Year")
-        .agg(
-            (
-                (pl.col("PolExpCapita") * pl.col("LatestCensusPop"))
-                .filter(pl.col("Provider_PPSA"))
-                .sum()
-                / pl.col("LatestCensusPop").filter(pl.col("Provider_PPSA")).sum()
-            ).alias("PolExpCapita_PPSA"),
-            (
-                (pl.col("PolExpCapita") * pl.col("LatestCensusPop"))
-                .filter(~pl.col("Provider_PPSA"))
-                .sum()
-                / pl.col("LatestCensusPop").filter(~pl.col("Provider_PPSA")).sum()
-            ).alias("PolExpCapita_nonPPSA"),
-        )
-        .sort("Year")
-        .with_columns(
-            (
-                (pl.col("PolExpCapita_PPSA") - pl.col("PolExpCapita_PPSA").shift(1))
-                / pl.col("PolExpCapita_PPSA").shift(1)
-                * 100
-            ).alias("PolExpCapita_PPSA_yoy"),
-            (
-                (
-                    pl.col("PolExpCapita_nonPPSA")
-                    - pl.col("PolExpCapita_nonPPSA").shift(1)
-                )
-                / pl.col("PolExpCapita_nonPPSA").shift(1)
-                * 100
-            ).alias("PolExpCapita_nonPPSA_yoy"),
-            (pl.col("PolExpCapita_nonPPSA") - pl.col("PolExpCapita_PPSA")).alias(
-                "PolExpCapita_diff"
-            ),
-        )
-    )
+def plot_polexpcapita(df_trends: pl.DataFrame) -> None:
+    df_weighted = get_ppsa_trend(df_trends, "PolExpCapita", "Weighted")
+    df_weighted_yoy = get_ppsa_trend(df_trends, "PolExpCapita_yoy", "Weighted")
 
     years_w = get_vals(df_weighted, "Year").astype(int)
 
     plt.figure()
-    sns.lineplot(x=years_w, y=get_vals(df_weighted, "PolExpCapita_PPSA"), label="PPSA")
-    sns.lineplot(
-        x=years_w, y=get_vals(df_weighted, "PolExpCapita_nonPPSA"), label="non-PPSA"
-    )
+    sns.lineplot(x=years_w, y=get_vals(df_weighted, "PPSA"), label="PPSA")
+    sns.lineplot(x=years_w, y=get_vals(df_weighted, "nonPPSA"), label="non-PPSA")
     plt.title("PolExpCapita")
     add_divider(plt.gca())
     plt.xticks(years_w, rotation=90)
@@ -91,12 +66,8 @@ def plot_polexpcapita(df: pl.DataFrame) -> None:
     plt.close()
 
     plt.figure()
-    sns.lineplot(
-        x=years_w, y=get_vals(df_weighted, "PolExpCapita_PPSA_yoy"), label="PPSA"
-    )
-    sns.lineplot(
-        x=years_w, y=get_vals(df_weighted, "PolExpCapita_nonPPSA_yoy"), label="non-PPSA"
-    )
+    sns.lineplot(x=years_w, y=get_vals(df_weighted_yoy, "PPSA"), label="PPSA")
+    sns.lineplot(x=years_w, y=get_vals(df_weighted_yoy, "nonPPSA"), label="non-PPSA")
     plt.title("YoY PolExpCapita (%)")
     add_divider(plt.gca())
     plt.xticks(years_w, rotation=90)
@@ -104,7 +75,7 @@ def plot_polexpcapita(df: pl.DataFrame) -> None:
     plt.close()
 
     plt.figure()
-    sns.lineplot(x=years_w, y=get_vals(df_weighted, "PolExpCapita_diff"))
+    sns.lineplot(x=years_w, y=get_vals(df_weighted, "Diff"))
     plt.title("non-PPSA - PPSA Difference")
     add_divider(plt.gca())
     plt.xticks(years_w, rotation=90)
@@ -113,82 +84,18 @@ def plot_polexpcapita(df: pl.DataFrame) -> None:
 
 
 # %%
-def plot_avgtaxrate(df: pl.DataFrame) -> None:
-    df_unweighted = (
-        df.drop("LatestCensusPop")
-        .group_by("Year")
-        .agg(
-            pl.col("AvgTaxRate")
-            .filter(pl.col("Provider_PPSA"))
-            .mean()
-            .alias("AvgTaxRate_PPSA"),
-            pl.col("AvgTaxRate")
-            .filter(~pl.col("Provider_PPSA"))
-            .mean()
-            .alias("AvgTaxRate_nonPPSA"),
-        )
-        .sort("Year")
-        .with_columns(
-            (
-                (pl.col("AvgTaxRate_PPSA") - pl.col("AvgTaxRate_PPSA").shift(1))
-                / pl.col("AvgTaxRate_PPSA").shift(1)
-                * 100
-            ).alias("AvgTaxRate_PPSA_yoy"),
-            (
-                (pl.col("AvgTaxRate_nonPPSA") - pl.col("AvgTaxRate_nonPPSA").shift(1))
-                / pl.col("AvgTaxRate_nonPPSA").shift(1)
-                * 100
-            ).alias("AvgTaxRate_nonPPSA_yoy"),
-            (pl.col("AvgTaxRate_nonPPSA") - pl.col("AvgTaxRate_PPSA")).alias(
-                "AvgTaxRate_diff"
-            ),
-        )
-    )
-
-    df_weighted = (
-        df.group_by("Year")
-        .agg(
-            (
-                (pl.col("AvgTaxRate") * pl.col("LatestCensusPop"))
-                .filter(pl.col("Provider_PPSA"))
-                .sum()
-                / pl.col("LatestCensusPop").filter(pl.col("Provider_PPSA")).sum()
-            ).alias("AvgTaxRate_PPSA"),
-            (
-                (pl.col("AvgTaxRate") * pl.col("LatestCensusPop"))
-                .filter(~pl.col("Provider_PPSA"))
-                .sum()
-                / pl.col("LatestCensusPop").filter(~pl.col("Provider_PPSA")).sum()
-            ).alias("AvgTaxRate_nonPPSA"),
-        )
-        .sort("Year")
-        .with_columns(
-            (
-                (pl.col("AvgTaxRate_PPSA") - pl.col("AvgTaxRate_PPSA").shift(1))
-                / pl.col("AvgTaxRate_PPSA").shift(1)
-                * 100
-            ).alias("AvgTaxRate_PPSA_yoy"),
-            (
-                (pl.col("AvgTaxRate_nonPPSA") - pl.col("AvgTaxRate_nonPPSA").shift(1))
-                / pl.col("AvgTaxRate_nonPPSA").shift(1)
-                * 100
-            ).alias("AvgTaxRate_nonPPSA_yoy"),
-            (pl.col("AvgTaxRate_nonPPSA") - pl.col("AvgTaxRate_PPSA")).alias(
-                "AvgTaxRate_diff"
-            ),
-        )
-    )
+def plot_avgtaxrate(df_trends: pl.DataFrame) -> None:
+    df_unweighted = get_ppsa_trend(df_trends, "AvgTaxRate", "Unweighted")
+    df_unweighted_yoy = get_ppsa_trend(df_trends, "AvgTaxRate_yoy", "Unweighted")
+    df_weighted = get_ppsa_trend(df_trends, "AvgTaxRate", "Weighted")
+    df_weighted_yoy = get_ppsa_trend(df_trends, "AvgTaxRate_yoy", "Weighted")
 
     years_unw = get_vals(df_unweighted, "Year").astype(int)
     years_w = get_vals(df_weighted, "Year").astype(int)
 
     plt.figure()
-    sns.lineplot(
-        x=years_unw, y=get_vals(df_unweighted, "AvgTaxRate_PPSA"), label="PPSA"
-    )
-    sns.lineplot(
-        x=years_unw, y=get_vals(df_unweighted, "AvgTaxRate_nonPPSA"), label="non-PPSA"
-    )
+    sns.lineplot(x=years_unw, y=get_vals(df_unweighted, "PPSA"), label="PPSA")
+    sns.lineplot(x=years_unw, y=get_vals(df_unweighted, "nonPPSA"), label="non-PPSA")
     plt.title("Unweighted AvgTaxRate")
     add_divider(plt.gca())
     plt.xticks(years_unw, rotation=90)
@@ -196,12 +103,10 @@ def plot_avgtaxrate(df: pl.DataFrame) -> None:
     plt.close()
 
     plt.figure()
-    sns.lineplot(
-        x=years_unw, y=get_vals(df_unweighted, "AvgTaxRate_PPSA_yoy"), label="PPSA"
-    )
+    sns.lineplot(x=years_unw, y=get_vals(df_unweighted_yoy, "PPSA"), label="PPSA")
     sns.lineplot(
         x=years_unw,
-        y=get_vals(df_unweighted, "AvgTaxRate_nonPPSA_yoy"),
+        y=get_vals(df_unweighted_yoy, "nonPPSA"),
         label="non-PPSA",
     )
     plt.title("Unweighted YoY AvgTaxRate (%)")
@@ -211,7 +116,7 @@ def plot_avgtaxrate(df: pl.DataFrame) -> None:
     plt.close()
 
     plt.figure()
-    sns.lineplot(x=years_unw, y=get_vals(df_unweighted, "AvgTaxRate_diff"))
+    sns.lineplot(x=years_unw, y=get_vals(df_unweighted, "Diff"))
     plt.title("Unweighted non-PPSA - PPSA Difference")
     add_divider(plt.gca())
     plt.xticks(years_unw, rotation=90)
@@ -219,10 +124,8 @@ def plot_avgtaxrate(df: pl.DataFrame) -> None:
     plt.close()
 
     plt.figure()
-    sns.lineplot(x=years_w, y=get_vals(df_weighted, "AvgTaxRate_PPSA"), label="PPSA")
-    sns.lineplot(
-        x=years_w, y=get_vals(df_weighted, "AvgTaxRate_nonPPSA"), label="non-PPSA"
-    )
+    sns.lineplot(x=years_w, y=get_vals(df_weighted, "PPSA"), label="PPSA")
+    sns.lineplot(x=years_w, y=get_vals(df_weighted, "nonPPSA"), label="non-PPSA")
     plt.title("Weighted AvgTaxRate")
     add_divider(plt.gca())
     plt.xticks(years_w, rotation=90)
@@ -230,12 +133,8 @@ def plot_avgtaxrate(df: pl.DataFrame) -> None:
     plt.close()
 
     plt.figure()
-    sns.lineplot(
-        x=years_w, y=get_vals(df_weighted, "AvgTaxRate_PPSA_yoy"), label="PPSA"
-    )
-    sns.lineplot(
-        x=years_w, y=get_vals(df_weighted, "AvgTaxRate_nonPPSA_yoy"), label="non-PPSA"
-    )
+    sns.lineplot(x=years_w, y=get_vals(df_weighted_yoy, "PPSA"), label="PPSA")
+    sns.lineplot(x=years_w, y=get_vals(df_weighted_yoy, "nonPPSA"), label="non-PPSA")
     plt.title("Weighted YoY AvgTaxRate (%)")
     add_divider(plt.gca())
     plt.xticks(years_w, rotation=90)
@@ -243,7 +142,7 @@ def plot_avgtaxrate(df: pl.DataFrame) -> None:
     plt.close()
 
     plt.figure()
-    sns.lineplot(x=years_w, y=get_vals(df_weighted, "AvgTaxRate_diff"))
+    sns.lineplot(x=years_w, y=get_vals(df_weighted, "Diff"))
     plt.title("Weighted non-PPSA - PPSA Difference")
     add_divider(plt.gca())
     plt.xticks(years_w, rotation=90)
@@ -256,6 +155,24 @@ def add_divider(ax):
     ax.axvline(DIVIDE_YEAR, color="red", linestyle="--")
 
 
+def get_ppsa_trend(
+    df_trends: pl.DataFrame, metric: str, weighting: str
+) -> pl.DataFrame:
+    return (
+        df_trends.filter(
+            (pl.col("Metric") == metric) & (pl.col("Weighting") == weighting)
+        )
+        .pivot("Provider_PPSA", index="Year", values="Value")
+        .sort("Year")
+        .select(
+            "Year",
+            pl.col("true").alias("PPSA"),
+            pl.col("false").alias("nonPPSA"),
+            (pl.col("false") - pl.col("true")).alias("Diff"),
+        )
+    )
+
+
 def get_vals(df, col):
     return df.select(col).to_numpy().ravel()
 
@@ -7,6 +7,7 @@
 
 # %%
 from pathlib import Path
+from sys import path
 
 import matplotlib.pyplot as plt
 import polars as pl
@@ -15,7 +16,17 @@ import seaborn as sns
 
 # %%
 WD = Path(__file__).parent
-SRC = WD.parent.parent / "data" / "data_final" / "data_master.xlsx"
+path.append(str(WD.parent))
+
+from data_access import load_data  # noqa: E402
+from groups import (  # noqa: E402
+    aggregate_trends,
+    get_rank_groups,
+    write_group_listing,
+)
+
+
+# %%
 TXT_DIR = WD / "txt"
 PLOTS_DIR = WD / "plots"
 DIVIDE_YEAR = 2012
@@ -25,7 +36,7 @@ GROUP_SIZE = 13
 # %%
 def main() -> None:
     df = (
-        pl.read_excel(SRC)
+        load_data()
         .select(
             [
                 "Year",
@@ -57,146 +68,86 @@ def main() -> None:
             .alias("polexp_diff_2011_2012")
         )
         .select(["Municipality", "polexp_diff_2011_2012"])
-        .sort("polexp_diff_2011_2012")
     )
 
-    unique_muns = polexp_diff.select("Municipality").to_series().to_list()
-
-    group_assignments = {}
-
-    for i, mun in enumerate(unique_muns):
-        group_id = i // GROUP_SIZE
-        group_assignments[mun] = group_id + 1
-
-    df = df.with_columns(
-        pl.col("Municipality")
-        .map_elements(lambda x: group_assignments[x], pl.Int16)
-        .alias("Group")
+    df_groups = get_rank_groups(
+        polexp_diff, "Municipality", "polexp_diff_2011_2012", GROUP_SIZE
     )
+    df = df.join(df_groups, on="Municipality", how="left", maintain_order="left")
 
     TXT_DIR.mkdir(parents=True, exist_ok=True)
+    write_group_listing(df_groups, "Municipality", TXT_DIR / "group_assignments.txt")
 
-    with open(TXT_DIR / "group_assignments.txt", "w") as f:
-        groups_dict = {}
-
-        for mun, group_id in group_assignments.items():
-            if group_id not in groups_dict:
-                groups_dict[group_id] = []
-
-            groups_dict[group_id].append(mun)
-
-        for group_id in sorted(groups_dict.keys()):
-            f.write(
-                f"Group {group_id} ({len(groups_dict[group_id])} municipalities):\n"
-            )
-
-            for mun in sorted(groups_dict[group_id]):
-                f.write(f"  - {mun}\n")
-
-            f.write("\n")
-
-    df_unweighted = (
-        df.group_by(["Year", "Group"])
-        .agg(
-            pl.col("AvgTaxRate").mean().alias("AvgTaxRate"),
-            pl.col("PolExpCapita").mean().alias("PolExpCapita"),
-            pl.col("LatestCensusPop").mean().alias("LatestCensusPop"),
-        )
-        .sort(["Group", "Year"])
-        .with_columns(
-            (
-                (pl.col("AvgTaxRate") - pl.col("AvgTaxRate").shift(1))
-                / pl.col("AvgTaxRate").shift(1)
-                * 100
-            )
-            .over("Group")
-            .alias("AvgTaxRate_yoy"),
-            (
-                (pl.col("PolExpCapita") - pl.col("PolExpCapita").shift(1))
-                / pl.col("PolExpCapita").shift(1)
-                * 100
-            )
-            .over("Group")
-            .alias("PolExpCapita_yoy"),
-        )
-    )
-
-    df_weighted = (
-        df.group_by(["Year", "Group"])
-        .agg(
-            (
-                (pl.col("AvgTaxRate") * pl.col("LatestCensusPop")).sum()
-                / pl.col("LatestCensusPop").sum()
-            ).alias("AvgTaxRate"),
-            (
-                (pl.col("PolExpCapita") * pl.col("LatestCensusPop")).sum()
-                / pl.col("LatestCensusPop").sum()
-            ).alias("PolExpCapita"),
-        )
-        .sort(["Group", "Year"])
-        .with_columns(
-            (
-                (pl.col("AvgTaxRate") - pl.col("AvgTaxRate").shift(1))
-                / pl.col("AvgTaxRate").shift(1)
-                * 100
-            )
-            .over("Group")
-            .alias("AvgTaxRate_yoy"),
-            (
-                (pl.col("PolExpCapita") - pl.col("PolExpCapita").shift(1))
-                / pl.col("PolExpCapita").shift(1)
-                * 100
-            )
-            .over("Group")
-            .alias("PolExpCapita_yoy"),
-        )
+    df_trends = aggregate_trends(
+        df,
+        ["AvgTaxRate", "PolExpCapita", "LatestCensusPop"],
+        ["Group"],
+        "LatestCensusPop",
     )
 
     PLOTS_DIR.mkdir(parents=True, exist_ok=True)
 
     plot_by_group(
-        df_unweighted, "AvgTaxRate", "Unweighted", "unweighted_avgtaxrate_groups.png"
+        df_trends,
+        "Unweighted",
+        "AvgTaxRate",
+        "Unweighted",
+        "unweighted_avgtaxrate_groups.png",
     )
     plot_by_group(
-        df_unweighted,
+        df_trends,
+        "Unweighted",
         "AvgTaxRate_yoy",
         "Unweighted",
         "unweighted_avgtaxrate_yoy_groups.png",
     )
     plot_by_group(
-        df_unweighted,
+        df_trends,
+        "Unweighted",
         "PolExpCapita",
         "Unweighted",
         "unweighted_polexpcapita_groups.png",
     )
     plot_by_group(
-        df_unweighted,
+        df_trends,
+        "Unweighted",
         "PolExpCapita_yoy",
         "Unweighted",
         "unweighted_polexpcapita_yoy_groups.png",
     )
 
     plot_by_group(
-        df_weighted, "AvgTaxRate", "Weighted", "weighted_avgtaxrate_groups.png"
+        df_trends,
+        "Weighted",
+        "AvgTaxRate",
+        "Weighted",
+        "weighted_avgtaxrate_groups.png",
     )
     plot_by_group(
-        df_weighted,
+        df_trends,
+        "Weighted",
         "AvgTaxRate_yoy",
         "Weighted YoY",
         "weighted_avgtaxrate_yoy_groups.png",
     )
     plot_by_group(
-        df_weighted, "PolExpCapita", "Weighted", "weighted_polexpcapita_groups.png"
+        df_trends,
+        "Weighted",
+        "PolExpCapita",
+        "Weighted",
+        "weighted_polexpcapita_groups.png",
     )
     plot_by_group(
-        df_weighted,
+        df_trends,
+        "Weighted",
         "PolExpCapita_yoy",
         "Weighted YoY",
         "weighted_polexpcapita_yoy_groups.png",
     )
 
     plot_by_group(
-        df_unweighted,
+        df_trends,
+        "Unweighted",
         "LatestCensusPop",
         "",
         "unweighted_latestcensuspop_groups.png",
@@ -208,7 +159,11 @@ def add_divider(ax):
     ax.axvline(DIVIDE_YEAR - 1, color="red", linestyle="--")
 
 
-def plot_by_group(df_data, metric, title_prefix, filename):
+def plot_by_group(df_trends, weighting, metric, title_prefix, filename):
+    df_data = df_trends.filter(
+        (pl.col("Weighting") == weighting) & (pl.col("Metric") == metric)
+    )
+
     plt.figure()
     for group_id in sorted(df_data.select("Group").unique().to_series().to_list()):
         if group_id in {3, 4}:
@@ -216,7 +171,7 @@ def plot_by_group(df_data, metric, title_prefix, filename):
 
         group_data = df_data.filter(pl.col("Group") == group_id)
         years = group_data.select("Year").to_series().to_list()
-        values = group_data.select(metric).to_series().to_list()
+        values = group_data.select("Value").to_series().to_list()
         sns.lineplot(x=years, y=values, label=f"Group {group_id}")
 
     plt.title(f"{title_prefix} {metric}")
@@ -6,21 +6,27 @@
 
 
 # %%
+from argparse import ArgumentParser
 from io import StringIO
 from pathlib import Path
+from sys import path
 
 import matplotlib.pyplot as plt
-import numpy as np
 import polars as pl
 import seaborn as sns
 
 from sklearn.cluster import KMeans
-from statsmodels.regression.linear_model import OLS, RegressionResultsWrapper
 
 
 # %%
 WD = Path(__file__).parent
-SRC = WD.parent.parent / "data" / "data_final" / "data_master.xlsx"
+path.append(str(WD.parent))
+
+from data_access import load_data  # noqa: E402
+from entity_ols import fit_entity_coeffs  # noqa: E402
+
+
+# %%
 TXT_DIR = WD / "txt"
 PLOTS_DIR = WD / "plots"
 
@@ -38,6 +44,10 @@ INDEP_VARS = [
 ENTITY_COL = "Municipality"
 FILTER_COL = "Provider_PPSA"
 
+# Per-municipality statsmodels fits on a process pool instead of the batched solver
+FULL_DIAGNOSTICS = False
+MAX_WORKERS = None  # Defaults to the number of CPUs
+
 
 # %%
 N_CLUSTERS = 2
@@ -46,7 +56,9 @@ RANDOM_STATE = 87
 
 
 # %%
-def main() -> None:
+def main(
+    full_diagnostics: bool = FULL_DIAGNOSTICS, max_workers: int | None = MAX_WORKERS
+) -> None:
     TXT_DIR.mkdir(parents=True, exist_ok=True)
     PLOTS_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -56,7 +68,7 @@ def main() -> None:
         + [ENTITY_COL, FILTER_COL]
     )
     df_base = (
-        pl.read_excel(SRC)
+        load_data()
         .with_columns(pl.col(TIME_VAR) - pl.col(TIME_VAR).min())
         .with_columns((pl.col(TIME_VAR) > CUTOFF).alias(INDIC_POST))
         .select(columns)
@@ -66,28 +78,39 @@ def main() -> None:
         df_base.filter(pl.col(FILTER_COL)).drop(FILTER_COL),
         TXT_DIR / "clustering_ppsa.txt",
         PLOTS_DIR / "clustering_ppsa.png",
+        full_diagnostics,
+        max_workers,
     )
     run_clustering(
         df_base.filter(~pl.col(FILTER_COL)).drop(FILTER_COL),
         TXT_DIR / "clustering_nonppsa.txt",
         PLOTS_DIR / "clustering_nonppsa.png",
+        full_diagnostics,
+        max_workers,
     )
 
 
 # %%
-def run_clustering(df: pl.DataFrame, txt_dst: Path, plot_dst: Path) -> None:
+def run_clustering(
+    df: pl.DataFrame,
+    txt_dst: Path,
+    plot_dst: Path,
+    full_diagnostics: bool,
+    max_workers: int | None,
+) -> None:
     transition_munis = get_transition_munis(df)
-    results = {muni: get_entity_regression(muni, df) for muni in transition_munis}
-
-    indicator_coeffs = np.array(
-        [results[muni].params[f"{INDIC_POST}[T.True]"] for muni in transition_munis]
-    )
-    interaction_coeffs = np.array(
-        [
-            results[muni].params[f"{TIME_VAR}:{INDIC_POST}[T.True]"]
-            for muni in transition_munis
-        ]
-    ).reshape(-1, 1)
+    interaction = f"{TIME_VAR}:{INDIC_POST}"
+    df_coeffs = fit_entity_coeffs(
+        df.filter(pl.col(ENTITY_COL).is_in(transition_munis)),
+        [DEP_VAR],
+        INDEP_VARS,
+        ENTITY_COL,
+        full_diagnostics,
+        max_workers,
+    ).pivot("Term", index=ENTITY_COL, values="Coef")
+
+    indicator_coeffs = df_coeffs.select(INDIC_POST).to_numpy()
+    interaction_coeffs = df_coeffs.select(interaction).to_numpy()
 
     plt.figure()
     sns.scatterplot(
@@ -100,13 +123,16 @@ def run_clustering(df: pl.DataFrame, txt_dst: Path, plot_dst: Path) -> None:
     kmeans = KMeans(N_CLUSTERS, n_init=N_INIT, random_state=RANDOM_STATE)
     cluster_labels = kmeans.fit_predict(interaction_coeffs)
 
-    muni_clusters = dict(zip(transition_munis, cluster_labels))
-    sorted_munis = sorted(
-        transition_munis,
-        key=lambda muni: (
-            muni_clusters[muni],
-            results[muni].params[f"{TIME_VAR}:{INDIC_POST}[T.True]"],
-        ),
+    # Clusters are numbered by their mean interaction coefficient, so the labels do
+    # not depend on the order in which the municipalities were fitted
+    df_coeffs = (
+        df_coeffs.with_columns(pl.Series("Cluster", cluster_labels))
+        .with_columns(
+            (pl.col(interaction).mean().over("Cluster").rank("dense") - 1).alias(
+                "Cluster"
+            )
+        )
+        .sort("Cluster", interaction)
     )
 
     out = StringIO()
@@ -114,22 +140,17 @@ def run_clustering(df: pl.DataFrame, txt_dst: Path, plot_dst: Path) -> None:
 
     for cluster in [0, 1]:
         out.write(f"\n=== CLUSTER {cluster} ===\n")
-        cluster_munis = [m for m in sorted_munis if muni_clusters[m] == cluster]
-
-        for muni in cluster_munis:
-            result = results[muni]
-            post = result.params[f"{INDIC_POST}[T.True]"]
-            inter = result.params[f"{TIME_VAR}:{INDIC_POST}[T.True]"]
+        df_cluster = df_coeffs.filter(pl.col("Cluster") == cluster)
 
+        for muni, post, inter in df_cluster.select(
+            ENTITY_COL, INDIC_POST, interaction
+        ).iter_rows():
             out.write(f"- {muni}:{' ' * (muni_width - len(muni) + 2)}")
             out.write(f"{INDIC_POST} = {post:8.3f},  ")
             out.write(f"{TIME_VAR}:{INDIC_POST} = {inter:8.5f}\n")
 
-        cluster_coeffs = [
-            results[m].params[f"{TIME_VAR}:{INDIC_POST}[T.True]"] for m in cluster_munis
-        ]
-        out.write(f"  Cluster mean: {np.mean(cluster_coeffs):.5f}\n")
-        out.write(f"  Cluster size: {len(cluster_munis)}\n")
+        out.write(f"  Cluster mean: {df_cluster[interaction].mean():.5f}\n")
+        out.write(f"  Cluster size: {df_cluster.height}\n")
 
     txt_dst.write_text(out.getvalue())
 
@@ -146,17 +167,20 @@ def get_transition_munis(df: pl.DataFrame) -> set[str]:
     return munis_pre.intersection(munis_post)
 
 
-# %%
-def get_entity_regression(
-    municipality: str, df: pl.DataFrame
-) -> RegressionResultsWrapper:
-    formula = f"{DEP_VAR} ~ 1 + {' + '.join(INDEP_VARS)}"
-    df_entity = df.filter(pl.col(ENTITY_COL) == municipality).to_pandas()
-    model = OLS.from_formula(formula, df_entity)
-
-    return model.fit()
-
-
 # %%
 if __name__ == "__main__":
-    main()
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--full-diagnostics",
+        action="store_true",
+        default=FULL_DIAGNOSTICS,
+        help="fit each municipality with statsmodels instead of the batched solver",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=MAX_WORKERS,
+        help="worker processes for --full-diagnostics (default: number of CPUs)",
+    )
+    args = parser.parse_args()
+    main(args.full_diagnostics, args.jobs)
@@ -6,16 +6,33 @@
 
 
 # %%
+from math import ceil, log10
 from pathlib import Path
+from sys import path
 
 import polars as pl
 
 from linearmodels.panel.model import PooledOLS
+from scipy import stats
+from statsmodels.iolib.summary import fmt_params
+from statsmodels.iolib.table import SimpleTable
 
 
 # %%
 WD = Path(__file__).parent
-SRC = WD.parent.parent / "data" / "data_final" / "data_master.xlsx"
+path.append(str(WD.parent))
+
+from data_access import load_data  # noqa: E402
+from design import (  # noqa: E402
+    DesignPlan,
+    build_panel,
+    compile_formula,
+    fit_nested_ols,
+    get_variables,
+)
+
+
+# %%
 TXT_DIR = WD / "txt"
 
 
@@ -46,37 +63,88 @@ MODELS = {
     ],
 }
 
+SUMMARIES = True  # Also fit PooledOLS for the full per-model summary tables
+SUITE_HEADERS = ["Parameter", "Std. Err.", "T-stat", "P-value", "Lower CI", "Upper CI"]
+
 
 # %%
-def main() -> None:
+def main(summaries: bool = SUMMARIES) -> None:
     TXT_DIR.mkdir(parents=True, exist_ok=True)
 
-    for model_name, indep_vars in MODELS.items():
-        run_ols(indep_vars, TXT_DIR / f"{model_name}.txt")
-
-
-# %%
-def run_ols(indep_vars: list[str], dst: Path) -> None:
-    formula = f"{DEP_VAR} ~ 1 + {' + '.join(indep_vars)}"
-    columns = (
-        [TIME_VAR]
-        + [DEP_VAR]
-        + list(dict.fromkeys(var for item in indep_vars for var in item.split(":")))
-    )
+    plans = {
+        model_name: compile_formula(f"{DEP_VAR} ~ 1 + {' + '.join(indep_vars)}")
+        for model_name, indep_vars in MODELS.items()
+    }
+    terms = list(dict.fromkeys(term for plan in plans.values() for term in plan.terms))
 
+    # The sample and the widest design are built once, and each model is fitted
+    # on a subset of its columns
     df = (
-        pl.read_excel(SRC)
+        load_data()
         .with_columns((pl.col(TIME_VAR) > 2011).alias(INDIC_2011))
-        .select(columns)
-        .to_pandas()
+        .select([TIME_VAR] + [DEP_VAR] + get_variables(terms))
+        .with_columns(pl.lit(1).alias("entity"))
     )
-    df["entity"] = 1
-    df = df.set_index(["entity", TIME_VAR])
+    y, X = build_panel(df, DesignPlan(DEP_VAR, tuple(terms), False), "entity", TIME_VAR)
 
-    model = PooledOLS.from_formula(formula, df)
-    result = model.fit()
+    df_suite = fit_nested_ols(
+        X.to_numpy(),
+        y.to_numpy(),
+        terms,
+        {model_name: list(plan.terms) for model_name, plan in plans.items()},
+    )
 
-    dst.write_text(str(result.summary))
+    write_suite(df_suite, len(y), TXT_DIR / "basic_ols_suite.txt")
+
+    if summaries:
+        for model_name, plan in plans.items():
+            model = PooledOLS(y, X[list(plan.terms)])
+            result = model.fit()
+
+            (TXT_DIR / f"{model_name}.txt").write_text(str(result.summary))
+
+
+def write_suite(df_suite: pl.DataFrame, nobs: int, dst: Path) -> None:
+    tables = []
+
+    # Inference matches the debiased defaults of PooledOLS, so each table agrees
+    # with the parameter estimates in the corresponding full summary
+    for (model_name,), df_model in df_suite.group_by("Model", maintain_order=True):
+        df_resid = nobs - df_model.height
+        quantile = stats.t.ppf(0.975, df_resid)
+        rows = [
+            [
+                format_estimate(coef),
+                format_estimate(std_err),
+                format_estimate(coef / std_err),
+                f"{2 * stats.t.sf(abs(coef / std_err), df_resid):.4f}",
+                format_estimate(coef - quantile * std_err),
+                format_estimate(coef + quantile * std_err),
+            ]
+            for coef, std_err in df_model.select("Coef", "StdErr").iter_rows()
+        ]
+        tables.append(
+            str(
+                SimpleTable(
+                    rows,
+                    SUITE_HEADERS,
+                    df_model["Term"].to_list(),
+                    model_name,
+                    txt_fmt=fmt_params,
+                )
+            )
+        )
+
+    dst.write_text("\n\n".join(tables) + "\n")
+
+
+def format_estimate(value: float) -> str:
+    digits = ceil(log10(abs(value))) if value != 0 else 0
+
+    if digits > 4 or digits <= -4:
+        return f"{value:8.4g}"
+
+    return f"{value:.{5 - digits if digits > 0 else 4}f}"
 
 
 # %%
@@ -6,19 +6,24 @@
 
 
 # %%
+from argparse import ArgumentParser
 from pathlib import Path
+from sys import path
 
 import matplotlib.pyplot as plt
-import numpy as np
 import polars as pl
 import seaborn as sns
 
-from statsmodels.regression.linear_model import OLS, RegressionResultsWrapper
-
 
 # %%
 WD = Path(__file__).parent
-SRC = WD.parent.parent / "data" / "data_final" / "data_master.xlsx"
+path.append(str(WD.parent))
+
+from data_access import load_data  # noqa: E402
+from entity_ols import fit_entity_coeffs  # noqa: E402
+
+
+# %%
 PLOTS_DIR = WD / "plots"
 
 
@@ -42,9 +47,15 @@ DIVIDE_COL = {
     "Provider_PPSA": ["PPSA", "Non-PPSA"],
 }
 
+# Per-municipality statsmodels fits on a process pool instead of the batched solver
+FULL_DIAGNOSTICS = False
+MAX_WORKERS = None  # Defaults to the number of CPUs
+
 
 # %%
-def main() -> None:
+def main(
+    full_diagnostics: bool = FULL_DIAGNOSTICS, max_workers: int | None = MAX_WORKERS
+) -> None:
     PLOTS_DIR.mkdir(parents=True, exist_ok=True)
 
     columns = (
@@ -54,7 +65,7 @@ def main() -> None:
         + list(DIVIDE_COL.keys())
     )
     df = (
-        pl.read_excel(SRC)
+        load_data()
         .with_columns((pl.col(TIME_VAR) > CUTOFF).alias(INDIC_POST))
         .select(columns)
     )
@@ -67,55 +78,29 @@ def main() -> None:
     divide_col_name = list(DIVIDE_COL.keys())[0]
     df_ppsa = df.filter(pl.col(divide_col_name))
     df_non_ppsa = df.filter(~pl.col(divide_col_name))
-    ppsa_munis = df_ppsa.select(ENTITY_COL).to_series().unique()
-    non_ppsa_munis = df_non_ppsa.select(ENTITY_COL).to_series().unique()
 
-    for dep_var, short_name in DEP_VARS.items():
-        results_ppsa = {
-            muni: get_entity_regression(dep_var, muni, df_ppsa) for muni in ppsa_munis
-        }
-        results_non_ppsa = {
-            muni: get_entity_regression(dep_var, muni, df_non_ppsa)
-            for muni in non_ppsa_munis
-        }
-
-        indicator_coeffs_ppsa = np.array(
-            [results_ppsa[muni].params[f"{INDIC_POST}[T.True]"] for muni in ppsa_munis]
-        )
-        interaction_coeffs_ppsa = np.array(
-            [
-                results_ppsa[muni].params[f"{TIME_VAR}:{INDIC_POST}[T.True]"]
-                for muni in ppsa_munis
-            ]
-        )
-        indicator_coeffs_non_ppsa = np.array(
-            [
-                results_non_ppsa[muni].params[f"{INDIC_POST}[T.True]"]
-                for muni in non_ppsa_munis
-            ]
-        )
-        interaction_coeffs_non_ppsa = np.array(
-            [
-                results_non_ppsa[muni].params[f"{TIME_VAR}:{INDIC_POST}[T.True]"]
-                for muni in non_ppsa_munis
-            ]
-        )
+    df_coeffs = pl.concat(
+        fit_entity_coeffs(
+            df_group,
+            list(DEP_VARS),
+            INDEP_VARS,
+            ENTITY_COL,
+            full_diagnostics,
+            max_workers,
+        ).with_columns(pl.lit(group).alias("Policing Provider"))
+        for group, df_group in zip(DIVIDE_COL[divide_col_name], [df_ppsa, df_non_ppsa])
+    )
 
-        df_plot_ppsa = pl.DataFrame(
-            {
-                "interaction": interaction_coeffs_ppsa,
-                "indicator": indicator_coeffs_ppsa,
-                "Policing Provider": DIVIDE_COL[divide_col_name][0],
-            }
-        )
-        df_plot_non_ppsa = pl.DataFrame(
-            {
-                "interaction": interaction_coeffs_non_ppsa,
-                "indicator": indicator_coeffs_non_ppsa,
-                "Policing Provider": DIVIDE_COL[divide_col_name][1],
-            }
+    for dep_var, short_name in DEP_VARS.items():
+        df_plot = (
+            df_coeffs.filter(pl.col("DepVar") == dep_var)
+            .pivot("Term", index=[ENTITY_COL, "Policing Provider"], values="Coef")
+            .select(
+                pl.col(f"{TIME_VAR}:{INDIC_POST}").alias("interaction"),
+                pl.col(INDIC_POST).alias("indicator"),
+                "Policing Provider",
+            )
         )
-        df_plot = pl.concat([df_plot_ppsa, df_plot_non_ppsa])
 
         for param, name in {
             "indicator": INDIC_POST,
@@ -175,17 +160,20 @@ def get_transition_munis(df: pl.DataFrame) -> set[str]:
     return munis_pre.intersection(munis_post)
 
 
-# %%
-def get_entity_regression(
-    dep_var: str, municipality: str, df: pl.DataFrame
-) -> RegressionResultsWrapper:
-    formula = f"{dep_var} ~ 1 + {' + '.join(INDEP_VARS)}"
-    df_entity = df.filter(pl.col(ENTITY_COL) == municipality).to_pandas()
-    model = OLS.from_formula(formula, df_entity)
-
-    return model.fit()
-
-
 # %%
 if __name__ == "__main__":
-    main()
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--full-diagnostics",
+        action="store_true",
+        default=FULL_DIAGNOSTICS,
+        help="fit each municipality with statsmodels instead of the batched solver",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=MAX_WORKERS,
+        help="worker processes for --full-diagnostics (default: number of CPUs)",
+    )
+    args = parser.parse_args()
+    main(args.full_diagnostics, args.jobs)
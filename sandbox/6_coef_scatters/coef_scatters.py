@@ -7,18 +7,22 @@
 
 # %%
 from pathlib import Path
+from sys import path
 
 import matplotlib.pyplot as plt
-import numpy as np
 import polars as pl
 import seaborn as sns
 
-from statsmodels.regression.linear_model import OLS, RegressionResultsWrapper
-
 
 # %%
 WD = Path(__file__).parent
-SRC = WD.parent.parent / "data" / "data_final" / "data_master.xlsx"
+path.append(str(WD.parent))
+
+from data_access import load_data  # noqa: E402
+from entity_ols import fit_entity_ols  # noqa: E402
+
+
+# %%
 PLOTS_DIR = WD / "plots"
 
 
@@ -54,7 +58,7 @@ def main() -> None:
         + list(DIVIDE_COL.keys())
     )
     df = (
-        pl.read_excel(SRC)
+        load_data()
         .with_columns((pl.col(TIME_VAR) > CUTOFF).alias(INDIC_POST))
         .select(columns)
     )
@@ -67,78 +71,29 @@ def main() -> None:
     divide_col_name = list(DIVIDE_COL.keys())[0]
     df_ppsa = df.filter(pl.col(divide_col_name))
     df_non_ppsa = df.filter(~pl.col(divide_col_name))
-    ppsa_munis = df_ppsa.select(ENTITY_COL).to_series().unique()
-    non_ppsa_munis = df_non_ppsa.select(ENTITY_COL).to_series().unique()
-
-    results_ppsa = {
-        dep_var: {
-            muni: get_entity_regression(dep_var, muni, df_ppsa) for muni in ppsa_munis
-        }
-        for dep_var in DEP_VARS.keys()
-    }
-    results_non_ppsa = {
-        dep_var: {
-            muni: get_entity_regression(dep_var, muni, df_non_ppsa)
-            for muni in non_ppsa_munis
-        }
-        for dep_var in DEP_VARS.keys()
-    }
-
-    plot_interaction_vs_indicator(
-        results_ppsa, results_non_ppsa, ppsa_munis, non_ppsa_munis, divide_col_name
-    )
-    plot_dep_var_vs_dep_var(
-        results_ppsa, results_non_ppsa, ppsa_munis, non_ppsa_munis, divide_col_name
+    df_coeffs = pl.concat(
+        fit_entity_ols(df_group, list(DEP_VARS), INDEP_VARS, ENTITY_COL).with_columns(
+            pl.lit(group).alias("Policing Provider")
+        )
+        for group, df_group in zip(DIVIDE_COL[divide_col_name], [df_ppsa, df_non_ppsa])
     )
 
+    plot_interaction_vs_indicator(df_coeffs)
+    plot_dep_var_vs_dep_var(df_coeffs)
+
 
 # %%
-def plot_interaction_vs_indicator(
-    results_ppsa, results_non_ppsa, ppsa_munis, non_ppsa_munis, divide_col_name
-) -> None:
+def plot_interaction_vs_indicator(df_coeffs: pl.DataFrame) -> None:
     for dep_var, short_name in DEP_VARS.items():
-        indicator_coeffs_ppsa = np.array(
-            [
-                results_ppsa[dep_var][muni].params[f"{INDIC_POST}[T.True]"]
-                for muni in ppsa_munis
-            ]
-        )
-        interaction_coeffs_ppsa = np.array(
-            [
-                results_ppsa[dep_var][muni].params[f"{TIME_VAR}:{INDIC_POST}[T.True]"]
-                for muni in ppsa_munis
-            ]
+        df_plot = (
+            df_coeffs.filter(pl.col("DepVar") == dep_var)
+            .pivot("Term", index=[ENTITY_COL, "Policing Provider"], values="Coef")
+            .select(
+                pl.col(f"{TIME_VAR}:{INDIC_POST}").alias("interaction"),
+                pl.col(INDIC_POST).alias("indicator"),
+                "Policing Provider",
+            )
         )
-        indicator_coeffs_non_ppsa = np.array(
-            [
-                results_non_ppsa[dep_var][muni].params[f"{INDIC_POST}[T.True]"]
-                for muni in non_ppsa_munis
-            ]
-        )
-        interaction_coeffs_non_ppsa = np.array(
-            [
-                results_non_ppsa[dep_var][muni].params[
-                    f"{TIME_VAR}:{INDIC_POST}[T.True]"
-                ]
-                for muni in non_ppsa_munis
-            ]
-        )
-
-        df_plot_ppsa = pl.DataFrame(
-            {
-                "interaction": interaction_coeffs_ppsa,
-                "indicator": indicator_coeffs_ppsa,
-                "Policing Provider": DIVIDE_COL[divide_col_name][0],
-            }
-        )
-        df_plot_non_ppsa = pl.DataFrame(
-            {
-                "interaction": interaction_coeffs_non_ppsa,
-                "indicator": indicator_coeffs_non_ppsa,
-                "Policing Provider": DIVIDE_COL[divide_col_name][1],
-            }
-        )
-        df_plot = pl.concat([df_plot_ppsa, df_plot_non_ppsa])
 
         plot = sns.scatterplot(
             data=df_plot,
@@ -158,45 +113,14 @@ def plot_interaction_vs_indicator(
 
 
 # %%
-def plot_dep_var_vs_dep_var(
-    results_ppsa, results_non_ppsa, ppsa_munis, non_ppsa_munis, divide_col_name
-) -> None:
-    for param in [f"{INDIC_POST}[T.True]", f"{TIME_VAR}:{INDIC_POST}[T.True]"]:
-        df_plot_ppsa = pl.DataFrame(
-            {
-                "PolExpCapita": np.array(
-                    [
-                        results_ppsa["PolExpCapita"][muni].params[param]
-                        for muni in ppsa_munis
-                    ]
-                ),
-                "AvgTaxRate": np.array(
-                    [
-                        results_ppsa["AvgTaxRate"][muni].params[param]
-                        for muni in ppsa_munis
-                    ]
-                ),
-                "Policing Provider": DIVIDE_COL[divide_col_name][0],
-            }
+def plot_dep_var_vs_dep_var(df_coeffs: pl.DataFrame) -> None:
+    for term in [INDIC_POST, f"{TIME_VAR}:{INDIC_POST}"]:
+        param = f"{term}[T.True]"
+        df_plot = (
+            df_coeffs.filter(pl.col("Term") == term)
+            .pivot("DepVar", index=[ENTITY_COL, "Policing Provider"], values="Coef")
+            .select("PolExpCapita", "AvgTaxRate", "Policing Provider")
         )
-        df_plot_non_ppsa = pl.DataFrame(
-            {
-                "PolExpCapita": np.array(
-                    [
-                        results_non_ppsa["PolExpCapita"][muni].params[param]
-                        for muni in non_ppsa_munis
-                    ]
-                ),
-                "AvgTaxRate": np.array(
-                    [
-                        results_non_ppsa["AvgTaxRate"][muni].params[param]
-                        for muni in non_ppsa_munis
-                    ]
-                ),
-                "Policing Provider": DIVIDE_COL[divide_col_name][1],
-            }
-        )
-        df_plot = pl.concat([df_plot_ppsa, df_plot_non_ppsa])
 
         plot = sns.scatterplot(
             data=df_plot,
@@ -227,17 +151,6 @@ def get_transition_munis(df: pl.DataFrame) -> set[str]:
     return munis_pre.intersection(munis_post)
 
 
-# %%
-def get_entity_regression(
-    dep_var: str, municipality: str, df: pl.DataFrame
-) -> RegressionResultsWrapper:
-    formula = f"{dep_var} ~ 1 + {' + '.join(INDEP_VARS)}"
-    df_entity = df.filter(pl.col(ENTITY_COL) == municipality).to_pandas()
-    model = OLS.from_formula(formula, df_entity)
-
-    return model.fit()
-
-
 # %%
 if __name__ == "__main__":
     main()
@@ -7,6 +7,7 @@
 
 # %%
 from pathlib import Path
+from sys import path
 
 import matplotlib.pyplot as plt
 import polars as pl
@@ -15,7 +16,17 @@ import seaborn as sns
 
 # %%
 WD = Path(__file__).parent
-SRC = WD.parent.parent / "data" / "data_final" / "data_master.xlsx"
+path.append(str(WD.parent))
+
+from data_access import load_data  # noqa: E402
+from groups import (  # noqa: E402
+    aggregate_trends,
+    get_rank_groups,
+    write_group_listing,
+)
+
+
+# %%
 TXT_DIR = WD / "txt"
 PLOTS_DIR = WD / "plots"
 DIVIDE_YEAR = 2012
@@ -32,7 +43,7 @@ def main() -> None:
     PLOTS_DIR.mkdir(parents=True, exist_ok=True)
 
     df_base = (
-        pl.read_excel(SRC)
+        load_data()
         .select(
             [
                 "Year",
@@ -66,102 +77,46 @@ def main() -> None:
 
 # %%
 def run_analysis(df: pl.DataFrame, group_size: int, suffix: str, title: str) -> None:
-    unique_muns = (
-        df.group_by("Municipality")
-        .agg(pl.col("PolExpShare").mean().alias("avg_polexpshare"))
-        .sort("avg_polexpshare")
-        .select("Municipality")
-        .to_series()
-        .to_list()
+    df_groups = get_rank_groups(
+        df.group_by("Municipality").agg(
+            pl.col("PolExpShare").mean().alias("avg_polexpshare")
+        ),
+        "Municipality",
+        "avg_polexpshare",
+        group_size,
     )
+    df = df.join(df_groups, on="Municipality", how="left", maintain_order="left")
 
-    group_assignments = {}
-    for i, mun in enumerate(unique_muns):
-        group_id = i // group_size
-        group_assignments[mun] = group_id + 1
-
-    df = df.with_columns(
-        pl.col("Municipality")
-        .map_elements(lambda x: group_assignments[x], pl.Int16)
-        .alias("Group")
+    write_group_listing(
+        df_groups, "Municipality", TXT_DIR / f"group_assignments_{suffix}.txt"
     )
 
-    with open(TXT_DIR / f"group_assignments_{suffix}.txt", "w") as f:
-        groups_dict = {}
-
-        for mun, group_id in group_assignments.items():
-            if group_id not in groups_dict:
-                groups_dict[group_id] = []
-
-            groups_dict[group_id].append(mun)
-
-        for group_id in sorted(groups_dict.keys()):
-            f.write(
-                f"Group {group_id} ({len(groups_dict[group_id])} municipalities):\n"
-            )
-
-            for mun in sorted(groups_dict[group_id]):
-                f.write(f"  - {mun}\n")
-
-            f.write("\n")
-
-    df_unweighted = (
-        df.group_by(["Year", "Group"])
-        .agg(
-            pl.col("PolExpShare").mean().alias("PolExpShare"),
-        )
-        .sort(["Group", "Year"])
-        .with_columns(
-            (
-                (pl.col("PolExpShare") - pl.col("PolExpShare").shift(1))
-                / pl.col("PolExpShare").shift(1)
-                * 100
-            )
-            .over("Group")
-            .alias("PolExpShare_yoy"),
-        )
-    )
-
-    df_weighted = (
-        df.group_by(["Year", "Group"])
-        .agg(
-            (
-                (pl.col("PolExpShare") * pl.col("PolExpCapita")).sum()
-                / pl.col("PolExpCapita").sum()
-            ).alias("PolExpShare"),
-        )
-        .sort(["Group", "Year"])
-        .with_columns(
-            (
-                (pl.col("PolExpShare") - pl.col("PolExpShare").shift(1))
-                / pl.col("PolExpShare").shift(1)
-                * 100
-            )
-            .over("Group")
-            .alias("PolExpShare_yoy"),
-        )
-    )
+    df_trends = aggregate_trends(df, ["PolExpShare"], ["Group"], "PolExpCapita")
 
     plot_by_group(
-        df_unweighted,
+        df_trends,
+        "Unweighted",
         "PolExpShare",
         f"{title}: Unweighted",
         f"unweighted_polexpshare_groups_{suffix}.png",
     )
     plot_by_group(
-        df_unweighted,
+        df_trends,
+        "Unweighted",
         "PolExpShare_yoy",
         f"{title}: Unweighted",
         f"unweighted_polexpshare_yoy_groups_{suffix}.png",
     )
     plot_by_group(
-        df_weighted,
+        df_trends,
+        "Weighted",
         "PolExpShare",
         f"{title}: Weighted",
         f"weighted_polexpshare_groups_{suffix}.png",
     )
     plot_by_group(
-        df_weighted,
+        df_trends,
+        "Weighted",
         "PolExpShare_yoy",
         f"{title}: Weighted",
         f"weighted_polexpshare_yoy_groups_{suffix}.png",
@@ -173,7 +128,11 @@ def add_divider(ax):
     ax.axvline(DIVIDE_YEAR - 1, color="red", linestyle="--")
 
 
-def plot_by_group(df_data, metric, title_prefix, filename):
+def plot_by_group(df_trends, weighting, metric, title_prefix, filename):
+    df_data = df_trends.filter(
+        (pl.col("Weighting") == weighting) & (pl.col("Metric") == metric)
+    )
+
     plt.figure()
     for group_id in sorted(df_data.select("Group").unique().to_series().to_list()):
         if group_id in {3, 4}:
@@ -181,7 +140,7 @@ def plot_by_group(df_data, metric, title_prefix, filename):
 
         group_data = df_data.filter(pl.col("Group") == group_id)
         years = group_data.select("Year").to_series().to_list()
-        values = group_data.select(metric).to_series().to_list()
+        values = group_data.select("Value").to_series().to_list()
         sns.lineplot(x=years, y=values, label=f"Group {group_id}")
 
     plt.title(f"{title_prefix} {metric}")
@@ -7,6 +7,7 @@
 
 # %%
 from pathlib import Path
+from sys import path
 
 import matplotlib.pyplot as plt
 import polars as pl
@@ -17,8 +18,14 @@ from linearmodels.panel.model import PanelOLS, PooledOLS
 
 # %%
 WD = Path(__file__).parent
-DATA_DIR = WD.parent.parent / "data" / "data_final"
-SRC_STEM = "data"
+path.append(str(WD.parent))
+
+from data_access import load_data  # noqa: E402
+from design import INTERCEPT, build_panel, compile_formula  # noqa: E402
+from entity_ols import fit_within_ols  # noqa: E402
+
+
+# %%
 TXT_DIR = WD / "txt"
 TEX_DIR = WD / "tex"
 PLOTS_DIR = WD / "plots"
@@ -53,24 +60,39 @@ JOIN_COLS = ["Year", "Municipality"]
 ENTITY_VAR = "Municipality"
 TIME_VAR = "Year"
 
+SHARE_PLAN = compile_formula(
+    "AvgTaxRate ~ 1 + PolExpShare*Provider_PPSA + UnconditionalGrant*Provider_PPSA"
+)
+CAPITA_INT_PLAN = compile_formula(
+    "AvgTaxRate ~ 1 + PolExpCapita*Provider_PPSA + UnconditionalGrantCapita*Provider_PPSA"
+)
+CAPITA_FULL_PLAN = compile_formula(
+    "AvgTaxRate ~ 1 + PolExpCapita + UnconditionalGrantCapita + "
+    "PolExpCapita:Provider_PPSA + UnconditionalGrantCapita:Provider_PPSA"
+)
+FE_PLAN = compile_formula(
+    "AvgTaxRate ~ 1 + PolExpCapita + UnconditionalGrantCapita + "
+    "PolExpCapita:Provider_PPSA + UnconditionalGrantCapita:Provider_PPSA + "
+    "EntityEffects"
+)
+FE_SAMPLES = {"full": pl.lit(True), "2012plus": pl.col(TIME_VAR) >= 2012}
+FE_SUMMARIES = True  # Also fit PanelOLS for the txt/tex summary tables
+
 
 # %%
-def main() -> None:
+def main(fe_summaries: bool = FE_SUMMARIES) -> None:
     TXT_DIR.mkdir(parents=True, exist_ok=True)
     TEX_DIR.mkdir(parents=True, exist_ok=True)
     PLOTS_DIR.mkdir(parents=True, exist_ok=True)
 
     run_share_regression()
     run_capita_regression()
-    run_capita_fe_regression()
+    run_capita_fe_regression(fe_summaries)
 
 
 # %%
 def run_share_regression() -> None:
-    dfs = [
-        pl.read_excel(DATA_DIR / f"{SRC_STEM}_{key}.xlsx", columns=cols)
-        for key, cols in COLUMNS_SHARE.items()
-    ]
+    dfs = [load_data(key, cols) for key, cols in COLUMNS_SHARE.items()]
     df = dfs[0]
 
     for other_df in dfs[1:]:
@@ -85,19 +107,15 @@ def run_share_regression() -> None:
         )
         .rename({"Unconditional Grant": "UnconditionalGrant"})
         .drop(["PolExpCapita", "OtherExpCapita"])
-        .to_pandas()
+        .with_columns(pl.lit(1).alias("entity"))
     )
 
-    formula = (
-        "AvgTaxRate ~ 1 + PolExpShare*Provider_PPSA + UnconditionalGrant*Provider_PPSA"
-    )
+    model = PooledOLS(*build_panel(df, SHARE_PLAN, "entity", TIME_VAR))
+    result = model.fit()
 
-    df["entity"] = 1
+    df = df.to_pandas()
     df.set_index(["entity", TIME_VAR], inplace=True)
 
-    model = PooledOLS.from_formula(formula, df)
-    result = model.fit()
-
     (TXT_DIR / "share_regression.txt").write_text(str(result.summary))
     (TEX_DIR / "share_regression.tex").write_text(result.summary.as_latex())
 
@@ -149,10 +167,7 @@ def run_share_regression() -> None:
 
 # %%
 def run_capita_regression() -> None:
-    dfs = [
-        pl.read_excel(DATA_DIR / f"{SRC_STEM}_{key}.xlsx", columns=cols)
-        for key, cols in COLUMNS_CAPITA.items()
-    ]
+    dfs = [load_data(key, cols) for key, cols in COLUMNS_CAPITA.items()]
     df = dfs[0]
 
     for other_df in dfs[1:]:
@@ -166,23 +181,18 @@ def run_capita_regression() -> None:
             )
         )
         .drop(["UnconditionalGrant", "LatestCensusPop"])
-        .to_pandas()
+        .with_columns(pl.lit(1).alias("entity"))
     )
 
-    df["entity"] = 1
-    df.set_index(["entity", TIME_VAR], inplace=True)
-
-    formula1 = "AvgTaxRate ~ 1 + PolExpCapita*Provider_PPSA + UnconditionalGrantCapita*Provider_PPSA"
-    model1 = PooledOLS.from_formula(formula1, df)
+    model1 = PooledOLS(*build_panel(df, CAPITA_INT_PLAN, "entity", TIME_VAR))
     result1 = model1.fit()
 
-    formula2 = (
-        "AvgTaxRate ~ 1 + PolExpCapita + UnconditionalGrantCapita + "
-        "PolExpCapita:Provider_PPSA + UnconditionalGrantCapita:Provider_PPSA"
-    )
-    model2 = PooledOLS.from_formula(formula2, df)
+    model2 = PooledOLS(*build_panel(df, CAPITA_FULL_PLAN, "entity", TIME_VAR))
     result2 = model2.fit()
 
+    df = df.to_pandas()
+    df.set_index(["entity", TIME_VAR], inplace=True)
+
     (TXT_DIR / "capita_regression_int.txt").write_text(str(result1.summary))
     (TXT_DIR / "capita_regression_full.txt").write_text(str(result2.summary))
     (TEX_DIR / "capita_regression_int.tex").write_text(result1.summary.as_latex())
@@ -281,11 +291,8 @@ def run_capita_regression() -> None:
 
 
 # %%
-def run_capita_fe_regression() -> None:
-    dfs = [
-        pl.read_excel(DATA_DIR / f"{SRC_STEM}_{key}.xlsx", columns=cols)
-        for key, cols in COLUMNS_CAPITA.items()
-    ]
+def run_capita_fe_regression(fe_summaries: bool = FE_SUMMARIES) -> None:
+    dfs = [load_data(key, cols) for key, cols in COLUMNS_CAPITA.items()]
     df = dfs[0]
 
     for other_df in dfs[1:]:
@@ -299,39 +306,53 @@ def run_capita_fe_regression() -> None:
             )
         )
         .drop(["UnconditionalGrant", "LatestCensusPop"])
-        .to_pandas()
     )
 
-    df.set_index([ENTITY_VAR, TIME_VAR], inplace=True)
-    formula = "AvgTaxRate ~ 1 + PolExpCapita + UnconditionalGrantCapita + PolExpCapita:Provider_PPSA + UnconditionalGrantCapita:Provider_PPSA + EntityEffects"
+    df_coeffs = fit_within_ols(
+        df,
+        FE_PLAN.dep_var,
+        [term for term in FE_PLAN.terms if term != INTERCEPT],
+        ENTITY_VAR,
+        FE_SAMPLES,
+    )
+    params1, params2 = (
+        dict(
+            df_coeffs.filter(pl.col("Sample") == sample)
+            .select("Term", "Coef")
+            .iter_rows()
+        )
+        for sample in ("full", "2012plus")
+    )
+
+    if fe_summaries:
+        for sample, expr in FE_SAMPLES.items():
+            y, X = build_panel(df.filter(expr), FE_PLAN, ENTITY_VAR, TIME_VAR)
+            model = PanelOLS(y, X, entity_effects=FE_PLAN.entity_effects)
+            result = model.fit(cov_type="clustered", cluster_entity=True)
 
-    model1 = PanelOLS.from_formula(formula, df)
-    result1 = model1.fit(cov_type="clustered", cluster_entity=True)
+            (TXT_DIR / f"capita_fe_regression_{sample}.txt").write_text(
+                str(result.summary)
+            )
+            (TEX_DIR / f"capita_fe_regression_{sample}.tex").write_text(
+                result.summary.as_latex()
+            )
 
+    df = df.to_pandas()
+    df.set_index([ENTITY_VAR, TIME_VAR], inplace=True)
     df_2012 = df.loc[df.index.get_level_values("Year") >= 2012].copy()
-    model2 = PanelOLS.from_formula(formula, df_2012)
-    result2 = model2.fit(cov_type="clustered", cluster_entity=True)
-
-    (TXT_DIR / "capita_fe_regression_full.txt").write_text(str(result1.summary))
-    (TXT_DIR / "capita_fe_regression_2012plus.txt").write_text(str(result2.summary))
-    (TEX_DIR / "capita_fe_regression_full.tex").write_text(result1.summary.as_latex())
-    (TEX_DIR / "capita_fe_regression_2012plus.tex").write_text(
-        result2.summary.as_latex()
-    )
 
     df_2012["AvgTaxRate_adj_full"] = 100 * (
         df_2012["AvgTaxRate"]
-        - result1.params["UnconditionalGrantCapita"]
-        * df_2012["UnconditionalGrantCapita"]
-        - result1.params["UnconditionalGrantCapita:Provider_PPSA"]
+        - params1["UnconditionalGrantCapita"] * df_2012["UnconditionalGrantCapita"]
+        - params1["UnconditionalGrantCapita:Provider_PPSA"]
         * df_2012["UnconditionalGrantCapita"]
         * df_2012["Provider_PPSA"]
     )
 
     df_2012["Fitted_full"] = 100 * (
-        result1.params["Intercept"]
-        + result1.params["PolExpCapita"] * df_2012["PolExpCapita"]
-        + result1.params["PolExpCapita:Provider_PPSA"]
+        params1["Intercept"]
+        + params1["PolExpCapita"] * df_2012["PolExpCapita"]
+        + params1["PolExpCapita:Provider_PPSA"]
         * df_2012["PolExpCapita"]
         * df_2012["Provider_PPSA"]
     )
@@ -364,17 +385,16 @@ def run_capita_fe_regression() -> None:
 
     df_2012["AvgTaxRate_adj_2012plus"] = 100 * (
         df_2012["AvgTaxRate"]
-        - result2.params["UnconditionalGrantCapita"]
-        * df_2012["UnconditionalGrantCapita"]
-        - result2.params["UnconditionalGrantCapita:Provider_PPSA"]
+        - params2["UnconditionalGrantCapita"] * df_2012["UnconditionalGrantCapita"]
+        - params2["UnconditionalGrantCapita:Provider_PPSA"]
         * df_2012["UnconditionalGrantCapita"]
         * df_2012["Provider_PPSA"]
     )
 
     df_2012["Fitted_2012plus"] = 100 * (
-        result2.params["Intercept"]
-        + result2.params["PolExpCapita"] * df_2012["PolExpCapita"]
-        + result2.params["PolExpCapita:Provider_PPSA"]
+        params2["Intercept"]
+        + params2["PolExpCapita"] * df_2012["PolExpCapita"]
+        + params2["PolExpCapita:Provider_PPSA"]
         * df_2012["PolExpCapita"]
         * df_2012["Provider_PPSA"]
     )
@@ -0,0 +1,103 @@
+# Copyright 2025 Craig Brett and Luis M. B. Varona
+#
+# Licensed under the MIT license <LICENSE or
+# http://opensource.org/licenses/MIT>. This file may not be copied, modified, or
+# distributed except according to those terms.
+
+
+# %%
+import hashlib
+import json
+import os
+
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+import polars as pl
+
+
+# %%
+WD = Path(__file__).resolve().parent
+DATA_DIR = WD.parent / "data" / "data_final"
+SRC_STEM = "data"
+CACHE_DIR = DATA_DIR / "cache"
+MANIFEST = CACHE_DIR / "manifest.json"
+
+# Tables mirrored as uncompressed Arrow IPC files that later runs memory-map
+KEYS_CACHED = ["master", "bgt_revs", "bgt_exps", "tax_base"]
+
+
+# %%
+# Source path -> ((mtime, size), frame), reloaded whenever the file is rewritten
+_CACHE: dict[Path, tuple[tuple[int, int], pl.DataFrame]] = {}
+
+
+def load_data(key: str = "master", columns: list[str] | None = None) -> pl.DataFrame:
+    src = DATA_DIR / f"{SRC_STEM}_{key}.parquet"
+    stat = src.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    if src not in _CACHE or _CACHE[src][0] != stamp:
+        _CACHE[src] = (
+            stamp,
+            load_from_disk_cache(src) if key in KEYS_CACHED else pl.read_parquet(src),
+        )
+
+    df = _CACHE[src][1]
+
+    return df if columns is None else df.select(columns)
+
+
+def load_from_disk_cache(src: Path) -> pl.DataFrame:
+    dst = CACHE_DIR / src.with_suffix(".arrow").name
+    manifest = load_manifest(MANIFEST)
+    stat = src.stat()
+    stamp = [stat.st_mtime_ns, stat.st_size]
+    entry = manifest.get(src.name) if dst.exists() else None
+
+    # Entries written before stamps were recorded hold only the digest
+    if not isinstance(entry, dict):
+        entry = {}
+
+    # The source is only hashed when its stamp has changed since the last run
+    if entry.get("stamp") == stamp:
+        return pl.read_ipc(dst, memory_map=True)
+
+    digest = hash_file(src)
+
+    if entry.get("sha256") != digest:
+        # Write to a fresh temporary file first, as other processes may have `dst`
+        # mapped or be rebuilding it concurrently
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+        with NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as f:
+            pl.read_parquet(src).write_ipc(f, compression="uncompressed")
+
+        os.replace(f.name, dst)
+
+    manifest[src.name] = {"stamp": stamp, "sha256": digest}
+    save_manifest(MANIFEST, manifest)
+
+    return pl.read_ipc(dst, memory_map=True)
+
+
+# %%
+def load_manifest(file: Path) -> dict[str, dict[str, list[int] | str]]:
+    if not file.exists():
+        return {}
+
+    return json.loads(file.read_text())
+
+
+def save_manifest(file: Path, manifest: dict[str, dict[str, list[int] | str]]) -> None:
+    with NamedTemporaryFile(
+        "w", dir=file.parent, suffix=".tmp", delete=False, encoding="utf-8"
+    ) as f:
+        f.write(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+
+    os.replace(f.name, file)
+
+
+def hash_file(file: Path) -> str:
+    with open(file, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
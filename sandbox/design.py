@@ -0,0 +1,133 @@
+# Copyright 2025 Craig Brett and Luis M. B. Varona
+#
+# Licensed under the MIT license <LICENSE or
+# http://opensource.org/licenses/MIT>. This file may not be copied, modified, or
+# distributed except according to those terms.
+
+
+# %%
+from functools import cache
+from itertools import combinations
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+
+# %%
+INTERCEPT = "Intercept"
+ENTITY_EFFECTS = "EntityEffects"
+
+
+# %%
+class DesignPlan(NamedTuple):
+    dep_var: str
+    terms: tuple[str, ...]
+    entity_effects: bool
+
+
+@cache
+def compile_formula(formula: str) -> DesignPlan:
+    dep_var, rhs = (side.strip() for side in formula.split("~"))
+    items = [item.strip() for item in rhs.split("+")]
+    intercept = "0" not in items
+    terms: dict[str, None] = {}
+
+    for item in items:
+        if item in ("0", "1", ENTITY_EFFECTS):
+            continue
+
+        # `a*b` expands to every interaction of its factors, lowest order first
+        factors = [factor.strip() for factor in item.split("*")]
+        terms.update(
+            (":".join(combo), None)
+            for order in range(1, len(factors) + 1)
+            for combo in combinations(factors, order)
+        )
+
+    # As in formulaic, terms are ordered by degree and then by first appearance
+    return DesignPlan(
+        dep_var,
+        (INTERCEPT,) * intercept + tuple(sorted(terms, key=lambda t: t.count(":"))),
+        ENTITY_EFFECTS in items,
+    )
+
+
+# %%
+def get_design_exprs(terms: list[str] | tuple[str, ...]) -> list[pl.Expr]:
+    return [
+        pl.lit(1.0).alias(INTERCEPT)
+        if term == INTERCEPT
+        else pl.reduce(
+            lambda acc, x: acc * x,
+            [pl.col(var).cast(pl.Float64) for var in term.split(":")],
+        ).alias(term)
+        for term in terms
+    ]
+
+
+def build_design(df: pl.DataFrame, terms: list[str] | tuple[str, ...]) -> np.ndarray:
+    return df.select(get_design_exprs(terms)).to_numpy(order="c")
+
+
+def build_panel(
+    df: pl.DataFrame, plan: DesignPlan, entity_col: str, time_col: str
+) -> tuple[pd.Series, pd.DataFrame]:
+    df = df.drop_nulls([plan.dep_var, *get_variables(plan.terms)])
+    index = pd.MultiIndex.from_arrays(
+        [df.get_column(entity_col).to_numpy(), df.get_column(time_col).to_numpy()],
+        names=[entity_col, time_col],
+    )
+
+    return (
+        pd.Series(
+            df.get_column(plan.dep_var).cast(pl.Float64).to_numpy(),
+            index,
+            name=plan.dep_var,
+        ),
+        pd.DataFrame(build_design(df, plan.terms), index, list(plan.terms)),
+    )
+
+
+def get_variables(terms: list[str] | tuple[str, ...]) -> list[str]:
+    return list(
+        dict.fromkeys(
+            var for term in terms if term != INTERCEPT for var in term.split(":")
+        )
+    )
+
+
+# %%
+def fit_nested_ols(
+    X: np.ndarray, y: np.ndarray, terms: list[str], models: dict[str, list[str]]
+) -> pl.DataFrame:
+    # Every model is a column subset of the widest design, so a single pass over
+    # the data yields all the cross-products that the nested fits need
+    Z = np.column_stack([X, y])
+    gram = Z.T @ Z
+    nobs, n_terms = X.shape
+    fits = []
+
+    for model, model_terms in models.items():
+        idx = [terms.index(term) for term in model_terms]
+        XtX_inv = np.linalg.inv(gram[np.ix_(idx, idx)])
+        Xty = gram[idx, n_terms]
+        coefs = XtX_inv @ Xty
+        scale = (gram[n_terms, n_terms] - coefs @ Xty) / (nobs - len(idx))
+        fits.append((model, model_terms, coefs, np.sqrt(np.diag(XtX_inv) * scale)))
+
+    return pl.DataFrame(
+        [
+            (model, term, coef, std_err)
+            for model, model_terms, coefs, std_errs in fits
+            for term, coef, std_err in zip(model_terms, coefs, std_errs)
+        ],
+        schema={
+            "Model": pl.Utf8,
+            "Term": pl.Utf8,
+            "Coef": pl.Float64,
+            "StdErr": pl.Float64,
+        },
+        orient="row",
+    )
@@ -0,0 +1,219 @@
+# Copyright 2025 Craig Brett and Luis M. B. Varona
+#
+# Licensed under the MIT license <LICENSE or
+# http://opensource.org/licenses/MIT>. This file may not be copied, modified, or
+# distributed except according to those terms.
+
+
+# %%
+from concurrent.futures import ProcessPoolExecutor
+from itertools import pairwise
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import polars as pl
+
+from statsmodels.regression.linear_model import OLS, RegressionResultsWrapper
+
+from design import INTERCEPT, build_design, get_design_exprs, get_variables
+from panel import partition_entities
+
+
+# %%
+def fit_entity_ols(
+    df: pl.DataFrame, dep_vars: list[str], indep_vars: list[str], entity_col: str
+) -> pl.DataFrame:
+    terms = [INTERCEPT] + indep_vars
+    variables = get_variables(indep_vars)
+    df, entities, offsets = partition_entities(
+        df.select(entity_col, *dep_vars, *variables).drop_nulls(), entity_col
+    )
+
+    if entities.is_empty():
+        return pl.DataFrame(
+            schema={
+                entity_col: entities.dtype,
+                "DepVar": pl.String,
+                "Term": pl.String,
+                "Coef": pl.Float64,
+                "StdErr": pl.Float64,
+            }
+        )
+
+    nobs = np.diff(offsets)
+    codes = np.repeat(np.arange(len(entities)), nobs)
+    rows = np.arange(df.height) - offsets[codes]
+
+    # Entities are stacked along the first axis and zero-padded to the longest one,
+    # which leaves each entity's least-squares problem unchanged
+    X = np.zeros((len(entities), nobs.max(), len(terms)))
+    Y = np.zeros((len(entities), nobs.max(), len(dep_vars)))
+    X[codes, rows] = build_design(df, terms)
+    Y[codes, rows] = df.select(pl.col(dep_vars).cast(pl.Float64)).to_numpy()
+
+    # As in statsmodels, the pseudoinverse yields the minimum-norm solution for
+    # rank-deficient entities. It depends only on the design, so each entity is
+    # factorized once and solved against every dependent variable.
+    X_pinv = np.linalg.pinv(X)
+    coefs = np.einsum("ekt,etr->erk", X_pinv, Y)
+    resid = Y - np.einsum("etk,erk->etr", X, coefs)
+    df_resid = nobs - np.linalg.matrix_rank(X)
+
+    # Entities without residual degrees of freedom have undefined standard errors.
+    # Depending on the residuals statsmodels yields inf or NaN, so they are masked.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(
+            df_resid[:, None] > 0,
+            np.einsum("etr,etr->er", resid, resid) / df_resid[:, None],
+            np.nan,
+        )
+    std_errs = np.sqrt(
+        scale[..., None] * np.einsum("ekt,ekt->ek", X_pinv, X_pinv)[:, None]
+    )
+    n_fits = len(entities) * len(dep_vars)
+
+    return pl.DataFrame(
+        {
+            entity_col: entities.gather(
+                np.repeat(np.arange(len(entities)), len(dep_vars) * len(terms))
+            ),
+            "DepVar": np.repeat(dep_vars * len(entities), len(terms)),
+            "Term": terms * n_fits,
+            "Coef": coefs.ravel(),
+            "StdErr": std_errs.ravel(),
+        }
+    )
+
+
+# %%
+def fit_within_ols(
+    df: pl.DataFrame,
+    dep_var: str,
+    indep_vars: list[str],
+    entity_col: str,
+    samples: dict[str, pl.Expr],
+) -> pl.DataFrame:
+    terms = [INTERCEPT] + indep_vars
+    variables = get_variables(indep_vars)
+    df, entities, offsets = partition_entities(
+        df.with_columns(**samples)
+        .select(entity_col, dep_var, *variables, *samples)
+        .drop_nulls([dep_var, *variables]),
+        entity_col,
+    )
+
+    # The entity index and design are built once and shared by every sample
+    codes = np.repeat(np.arange(len(entities)), np.diff(offsets))
+    X = build_design(df, terms)
+    y = df.select(pl.col(dep_var).cast(pl.Float64)).to_numpy()
+    masks = df.select(pl.col(list(samples)).fill_null(False)).to_numpy().T
+    coefs = [
+        solve_within(X[mask], y[mask, 0], codes[mask], len(entities)) for mask in masks
+    ]
+
+    # Only point estimates are returned, as the clustered standard errors are
+    # reported by the PanelOLS summary tables
+    return pl.DataFrame(
+        {
+            "Sample": np.repeat(list(samples), len(terms)),
+            "Term": terms * len(samples),
+            "Coef": np.concatenate(coefs),
+        }
+    )
+
+
+def solve_within(
+    X: np.ndarray, y: np.ndarray, codes: np.ndarray, n_entities: int
+) -> np.ndarray:
+    # As in linearmodels, the grand mean is added back after demeaning so that the
+    # intercept is identified alongside the entity effects
+    X_within = demean_within(X, codes, n_entities)
+    y_within = demean_within(y[:, None], codes, n_entities)[:, 0]
+
+    return np.linalg.lstsq(X_within, y_within, rcond=None)[0]
+
+
+def demean_within(a: np.ndarray, codes: np.ndarray, n_entities: int) -> np.ndarray:
+    counts = np.maximum(np.bincount(codes, minlength=n_entities), 1)
+    means = np.column_stack(
+        [np.bincount(codes, col, n_entities) / counts for col in a.T]
+    )
+
+    return a - means[codes] + a.mean(axis=0)
+
+
+# %%
+def fit_entity_coeffs(
+    df: pl.DataFrame,
+    dep_vars: list[str],
+    indep_vars: list[str],
+    entity_col: str,
+    full_diagnostics: bool = False,
+    max_workers: int | None = None,
+) -> pl.DataFrame:
+    if full_diagnostics:
+        results = fit_entity_models(df, dep_vars, indep_vars, entity_col, max_workers)
+        return tidy_entity_models(results, entity_col)
+
+    return fit_entity_ols(df, dep_vars, indep_vars, entity_col)
+
+
+def fit_entity_models(
+    df: pl.DataFrame,
+    dep_vars: list[str],
+    indep_vars: list[str],
+    entity_col: str,
+    max_workers: int | None = None,
+) -> dict[str, dict[str, RegressionResultsWrapper]]:
+    terms = [INTERCEPT] + indep_vars
+    variables = get_variables(indep_vars)
+    df, entities, offsets = partition_entities(
+        df.select(entity_col, *dep_vars, *variables).drop_nulls(), entity_col
+    )
+    df = df.select(pl.col(dep_vars).cast(pl.Float64), *get_design_exprs(terms))
+
+    # Workers memory-map the panel from an Arrow IPC file rather than receiving a
+    # pickled copy, and results are collected in entity order
+    with TemporaryDirectory() as tmp_dir:
+        src = Path(tmp_dir) / "panel.arrow"
+        df.write_ipc(src, compression="uncompressed")
+
+        with ProcessPoolExecutor(max_workers) as executor:
+            futures = [
+                executor.submit(fit_entity_slice, src, dep_vars, terms, start, end)
+                for start, end in pairwise(offsets)
+            ]
+
+        return {entity: future.result() for entity, future in zip(entities, futures)}
+
+
+def fit_entity_slice(
+    src: Path, dep_vars: list[str], terms: list[str], start: int, end: int
+) -> dict[str, RegressionResultsWrapper]:
+    df = pl.read_ipc(src, memory_map=True).slice(start, end - start).to_pandas()
+
+    return {dep_var: OLS(df[dep_var], df[terms]).fit() for dep_var in dep_vars}
+
+
+def tidy_entity_models(
+    results: dict[str, dict[str, RegressionResultsWrapper]], entity_col: str
+) -> pl.DataFrame:
+    return pl.DataFrame(
+        [
+            (entity, dep_var, term, coef, std_err)
+            for entity, fits in results.items()
+            for dep_var, result in fits.items()
+            for term, coef, std_err in zip(
+                result.params.index, result.params, result.bse
+            )
+        ],
+        schema={
+            entity_col: pl.Utf8,
+            "DepVar": pl.Utf8,
+            "Term": pl.Utf8,
+            "Coef": pl.Float64,
+            "StdErr": pl.Float64,
+        },
+        orient="row",
+    )
@@ -0,0 +1,93 @@
+# Copyright 2025 Craig Brett and Luis M. B. Varona
+#
+# Licensed under the MIT license <LICENSE or
+# http://opensource.org/licenses/MIT>. This file may not be copied, modified, or
+# distributed except according to those terms.
+
+
+# %%
+from pathlib import Path
+
+import polars as pl
+
+
+# %%
+GROUP_COL = "Group"
+
+
+# %%
+def get_rank_groups(
+    df_keys: pl.DataFrame, entity_col: str, key_col: str, group_size: int
+) -> pl.DataFrame:
+    # As in a plain sort on the key, null keys come first. Ties are broken by entity
+    # so that membership does not depend on the input order.
+    return df_keys.sort(key_col, entity_col).select(
+        entity_col,
+        (pl.int_range(pl.len()) // group_size + 1).cast(pl.Int16).alias(GROUP_COL),
+    )
+
+
+def write_group_listing(
+    df_groups: pl.DataFrame, entity_col: str, dst: Path, label: str = "municipalities"
+) -> None:
+    df_listing = (
+        df_groups.group_by(GROUP_COL).agg(pl.col(entity_col).sort()).sort(GROUP_COL)
+    )
+
+    dst.write_text(
+        "".join(
+            f"Group {group_id} ({len(entities)} {label}):\n"
+            + "".join(f"  - {entity}\n" for entity in entities)
+            + "\n"
+            for group_id, entities in df_listing.iter_rows()
+        )
+    )
+
+
+# %%
+def aggregate_trends(
+    df: pl.DataFrame,
+    metrics: list[str],
+    keys: list[str],
+    weight_col: str | None = None,
+    time_col: str = "Year",
+) -> pl.DataFrame:
+    aggs = {(metric, "Unweighted"): pl.col(metric).mean() for metric in metrics}
+
+    if weight_col is not None:
+        aggs.update(
+            {
+                (metric, "Weighted"): (pl.col(metric) * pl.col(weight_col)).sum()
+                / pl.col(weight_col).sum()
+                for metric in metrics
+            }
+        )
+
+    # Every level is computed in one group_by, with aggregations keyed by position
+    # since metric names may repeat across weightings
+    df_levels = (
+        df.group_by([time_col, *keys])
+        .agg(expr.alias(str(i)) for i, expr in enumerate(aggs.values()))
+        .sort([*keys, time_col])
+    )
+    df_levels = df_levels.with_columns(
+        get_yoy_expr(str(i), keys).alias(f"{i}_yoy") for i in range(len(aggs))
+    )
+
+    return pl.concat(
+        df_levels.select(
+            *keys,
+            time_col,
+            pl.lit(name).alias("Metric"),
+            pl.lit(weighting).alias("Weighting"),
+            pl.col(col).alias("Value"),
+        )
+        for i, (metric, weighting) in enumerate(aggs)
+        for name, col in ((metric, str(i)), (f"{metric}_yoy", f"{i}_yoy"))
+    )
+
+
+def get_yoy_expr(col: str, keys: list[str]) -> pl.Expr:
+    expr = (pl.col(col) - pl.col(col).shift(1)) / pl.col(col).shift(1) * 100
+
+    return expr.over(keys) if keys else expr
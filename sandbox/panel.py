@@ -0,0 +1,37 @@
+# Copyright 2025 Craig Brett and Luis M. B. Varona
+#
+# Licensed under the MIT license <LICENSE or
+# http://opensource.org/licenses/MIT>. This file may not be copied, modified, or
+# distributed except according to those terms.
+
+
+# %%
+from collections.abc import Iterator
+
+import numpy as np
+import polars as pl
+
+
+# %%
+def partition_entities(
+    df: pl.DataFrame, entity_col: str
+) -> tuple[pl.DataFrame, pl.Series, np.ndarray]:
+    df = df.sort(entity_col, maintain_order=True)
+    df_counts = df.select(
+        pl.col(entity_col).unique(maintain_order=True),
+        pl.col(entity_col).unique_counts().alias("Count"),
+    )
+    offsets = np.zeros(df_counts.height + 1, dtype=np.int64)
+    np.cumsum(df_counts.select("Count").to_series().to_numpy(), out=offsets[1:])
+
+    return df, df_counts.to_series(0), offsets
+
+
+def iter_entities(
+    df: pl.DataFrame, entity_col: str
+) -> Iterator[tuple[str, pl.DataFrame]]:
+    df, entities, offsets = partition_entities(df, entity_col)
+
+    # Slices share the sorted frame's buffers, so no entity is ever copied
+    for entity, start, end in zip(entities, offsets[:-1], offsets[1:]):
+        yield entity, df.slice(start, end - start)
@@ -6,6 +6,10 @@
 
 
 # %%
+import hashlib
+import json
+
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 from pathlib import Path
 from shutil import copy2
@@ -19,27 +23,110 @@ import polars as pl
 WD = Path(__file__).parent
 path.append(str(WD.parent))
 
-from utils import suppress_fastexcel_logging  # noqa: E402
+from utils import EXCEL_ERRORS, suppress_fastexcel_logging  # noqa: E402
 
 
 # %%
 DATA_DIR = WD.parent.parent / "data"
 SRC_DIR = DATA_DIR / "data_raw"
 DST_DIR = DATA_DIR / "data_xlsx"
+MANIFEST = DST_DIR / "manifest.json"
+SUFFIXES = (".xlsx", ".xls", ".xlw")
+MAX_WORKERS = None  # Defaults to the number of CPUs
+
+# Bump whenever `cp_excel_as_xlsx` changes its output, to force reconversion.
+CONVERTER_VERSION = 1
 
 
 # %%
-@suppress_fastexcel_logging
 def main() -> None:
-    for suffix in (".xlsx", ".xls", ".xlw"):
-        for file in SRC_DIR.rglob(f"*{suffix}"):
-            cp_excel_as_xlsx(file, SRC_DIR, DST_DIR)
+    files = sorted(file for file in SRC_DIR.rglob("*") if file.suffix in SUFFIXES)
+    manifest = load_manifest(MANIFEST)
+    entries = {
+        file: {"sha256": hash_file(file), "version": CONVERTER_VERSION}
+        for file in files
+    }
+
+    pending = [
+        file
+        for file, entry in entries.items()
+        if manifest.get(get_key(file, SRC_DIR)) != entry
+        or not get_dst(file, SRC_DIR, DST_DIR).exists()
+    ]
+    failures = convert_all(pending, SRC_DIR, DST_DIR, MAX_WORKERS)
+
+    save_manifest(
+        MANIFEST,
+        {
+            get_key(file, SRC_DIR): entry
+            for file, entry in entries.items()
+            if file not in failures
+        },
+    )
+
+    if failures:
+        raise RuntimeError(
+            "Failed to convert the following files:\n"
+            + "\n".join(f"  - {file}: {error}" for file, error in failures.items())
+        )
+
+
+def convert_all(
+    files: list[Path], src_dir: Path, dst_dir: Path, max_workers: int | None
+) -> dict[Path, str]:
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = {
+            file: executor.submit(try_cp_excel_as_xlsx, file, src_dir, dst_dir)
+            for file in files
+        }
+
+    return {
+        file: error
+        for file, future in futures.items()
+        if (error := future.result()) is not None
+    }
+
+
+def try_cp_excel_as_xlsx(file: Path, src_dir: Path, dst_dir: Path) -> str | None:
+    try:
+        cp_excel_as_xlsx(file, src_dir, dst_dir)
+    except EXCEL_ERRORS as exc:  # Not all reader exceptions survive pickling
+        return repr(exc)
+
+    return None
 
 
 # %%
+def load_manifest(file: Path) -> dict[str, dict]:
+    if not file.exists():
+        return {}
+
+    return json.loads(file.read_text())
+
+
+def save_manifest(file: Path, manifest: dict[str, dict]) -> None:
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+
+
+def get_key(file: Path, src_dir: Path) -> str:
+    return file.relative_to(src_dir).as_posix()
+
+
+def hash_file(file: Path) -> str:
+    with open(file, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+# %%
+def get_dst(file: Path, src_dir: Path, dst_dir: Path) -> Path:
+    return dst_dir / file.relative_to(src_dir).with_suffix(".xlsx")
+
+
+@suppress_fastexcel_logging
 def cp_excel_as_xlsx(file: Path, src_dir: Path, dst_dir: Path) -> None:
     suffix = file.suffix.lower()
-    dst = dst_dir / file.relative_to(src_dir).with_suffix(".xlsx")
+    dst = get_dst(file, src_dir, dst_dir)
 
     if suffix == ".xlsx":
         dst.parent.mkdir(parents=True, exist_ok=True)
@@ -6,11 +6,10 @@
 
 
 # %%
-import re
-
-from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from sys import path
+from time import perf_counter
 
 import polars as pl
 import polars.selectors as cs
@@ -20,74 +19,60 @@ import polars.selectors as cs
 WD = Path(__file__).parent
 path.append(str(WD.parent))
 
-from utils import suppress_fastexcel_logging  # noqa: E402
+from munis import canonicalize  # noqa: E402
+from storage import SCHEMAS_MASTER, write_frame  # noqa: E402
+from utils import EXCEL_ERRORS, suppress_fastexcel_logging  # noqa: E402
 
 
 # %%
 DATA_DIR = WD.parent.parent / "data"
 SRC_DIR = DATA_DIR / "data_xlsx"
 DST_DIR = DATA_DIR / "data_clean"
+EXPORT_XLSX = True
+ANCHOR_PATTERN = r"(?i)^(Fredericton|Bathurst)"
+MAX_WORKERS = None  # Defaults to the number of CPUs
 
 
 # %%
-@suppress_fastexcel_logging
 def main() -> None:
-    write_clean_pol_prov_data()
-    write_clean_bgt_exps_data()
-    write_clean_bgt_revs_data()
-    write_clean_cmp_data()
-    write_clean_tax_base_data()
+    jobs = [
+        (cat, file)
+        for cat in CLEANERS
+        for file in sorted(SRC_DIR.rglob(f"*_{cat}.xlsx"))
+    ]
+    summary = run_jobs(jobs, MAX_WORKERS)
 
+    with pl.Config(tbl_rows=-1, fmt_str_lengths=80):
+        print(summary.sort("Seconds", descending=True))
 
-# %%
-def clean_munis(df: pl.DataFrame) -> pl.DataFrame:
-    return df.with_columns(
-        pl.col("Municipality")
-        .str.to_titlecase()
-        .str.replace_all(r"\s[-\(].*", "")
-        .str.strip_chars()
-        .str.replace_all(r"\n\s*", "")
-        .str.replace_all(r"_X000(D|d)_", "")
-        .str.replace_all(r"\\", "/")
-        .str.replace_all(r"-\s*", "-")
-        .str.replace_all(" De ", " de ")
-        .str.replace_all("-De-", "-de-")
-        .str.replace(r"^Aroostock$", "Aroostook")
-        .str.replace(r"^Baker Brook$", "Baker-Brook")
-        .str.replace(r"^Grande Anse$", "Grande-Anse")
-        .str.replace(r"^Grand Bay/Westfield$", "Grand Bay-Westfield")
-        .str.replace(r"^Grand-Falls/Grand-Sault$", "Grand Falls/Grand-Sault")
-        .str.replace(r"^Grand-Sault\s*/\s*Grand(\s|-)Falls$", "Grand Falls/Grand-Sault")
-        .str.replace(r"^Lameque$", "Lamèque")
-        .str.replace(r"^Mcadam$", "McAdam")
-        .str.replace(r"^Neguac$", "Néguac")
-        .str.replace(r"^Saint-Francois-de-Madawaska$", "Saint-François-de-Madawaska")
-        .str.replace(r"^Saint-Louis de Kent$", "Saint-Louis-de-Kent")
-        .str.replace(r"^Sainte-Marie-Saint-Rapha(e|ê)l$", "Sainte-Marie-Saint-Raphaël")
-        .str.replace(r"^Shédiac$", "Shediac")
-        .str.replace(r"^St-Hilaire$", "Saint-Hilaire")
-        .str.replace(r"^St-Isidore$", "Saint-Isidore")
-        .str.replace(r"^St. Andrews$", "Saint Andrews")
-        .str.replace(r"^St. André$", "Saint-André")
-        .str.replace(r"^St. George$", "Saint George")
-        .str.replace(r"^St. Hilaire$", "Saint-Hilaire")
-        .str.replace(r"^St. Léonard$", "Saint-Léonard")
-        .str.replace(r"^Ste-Anne-de-Madawaska$", "Sainte-Anne-de-Madawaska")
-        .str.replace(r"^Town (O|o)f Rothesay$", "Rothesay")
-        .str.replace(r"^(Village de )?Lac(\s|-)Baker$", "Lac Baker")
-    )
+    failures = summary.filter(pl.col("Error").is_not_null())
+
+    if not failures.is_empty():
+        raise RuntimeError(
+            "Failed to clean the following files:\n"
+            + "\n".join(
+                f"  - {file}: {error}"
+                for file, error in failures.select("File", "Error").iter_rows()
+            )
+        )
 
 
 # %%
-def write_clean_pol_prov_data() -> None:
-    file = next(SRC_DIR.rglob("*_pol_prov.xlsx"))
-    dst = DST_DIR / file.relative_to(SRC_DIR)
-    dst.parent.mkdir(parents=True, exist_ok=True)
+def read_excel_from_anchor(file: Path) -> pl.DataFrame:
+    df = pl.read_excel(file, has_header=False)
+    skip = df.select(pl.nth(1).str.contains(ANCHOR_PATTERN).arg_true().first()).item()
+
+    if skip is None:
+        raise ValueError(f"No anchor row matching `{ANCHOR_PATTERN}` in `{file}`.")
 
-    df = clean_pol_prov_data(file)
-    df.write_excel(dst, header_format={"bold": True}, autofit=True)
+    return df.slice(skip)
+
+
+def clean_munis(df: pl.DataFrame) -> pl.DataFrame:
+    return df.with_columns(canonicalize(df["Municipality"], "muni"))
 
 
+# %%
 def clean_pol_prov_data(file: Path) -> pl.DataFrame:
     df_init = (
         pl.read_excel(file, columns=[0, 8])
@@ -107,36 +92,17 @@ def clean_pol_prov_data(file: Path) -> pl.DataFrame:
         *(token for value in muni_map.values() for token in value)
     )
 
-    return (
-        pl.DataFrame(
-            {
-                "District": districts,
-                "Municipality": municipalities,
-                "Policing Provider": providers,
-            }
-        )
-        .filter(pl.col("District").str.contains(r"\s(C|TV|V)$"))
-        .with_columns(
-            pl.col("District")
-            .str.replace(r"\s(C|TV|V)$", "")
-            .str.replace(r"^Baker Brook$", "Baker-Brook")
-            .str.replace(r"^Cambridge Narrows$", "Cambridge-Narrows")
-            .str.replace(r"^Neguac", "Néguac")
-            .str.replace(r"^Plaster Rocker$", "Plaster Rock")
-            .str.replace(r"^Saint-Anne$", "Sainte-Anne-de-Madawaska")
-            .str.replace(r"^Saint-François$", "Saint-François-de-Madawaska")
-            .str.replace(r"^Ste-Marie-St-Raphael$", "Sainte-Marie-Saint-Raphaël")
-            .str.replace(r"^Tracadie$", "Tracadie-Sheila")
-            .str.replace(r"^Eel Riv.*", "Eel River Crossing")
-            .str.replace(r"^Grand-Sault.*", "Grand Falls/Grand-Sault")
-            .str.replace(r"^Nackawic.*", "Nackawic")
-        )
-        .with_columns(
-            pl.col("Municipality")
-            .str.replace(r"^Tracadie$", "Tracadie-Sheila")
-            .str.replace(r"^Grand-Sault.*", "Grand Falls/Grand-Sault")
-            .str.replace(r"^Nackawic.*", "Nackawic")
-        )
+    df = pl.DataFrame(
+        {
+            "District": districts,
+            "Municipality": municipalities,
+            "Policing Provider": providers,
+        }
+    ).filter(pl.col("District").str.contains(r"\s(C|TV|V)$"))
+
+    return df.with_columns(
+        canonicalize(df["District"], "pol_prov_district"),
+        canonicalize(df["Municipality"], "pol_prov_muni"),
     )
 
 
@@ -174,22 +140,8 @@ def _get_pol_prov_muni_map(df_init: pl.DataFrame) -> dict[str, list[tuple]]:
 
 
 # %%
-def write_clean_bgt_exps_data() -> None:
-    for file in SRC_DIR.rglob("*_bgt_exps.xlsx"):
-        dst = DST_DIR / file.relative_to(SRC_DIR)
-        dst.parent.mkdir(parents=True, exist_ok=True)
-
-        df = clean_bgt_exps_data(file)
-        df.write_excel(dst, header_format={"bold": True}, autofit=True)
-
-
 def clean_bgt_exps_data(file: Path) -> pl.DataFrame:
-    df_init = pl.read_excel(file, has_header=False)
-    skip = next(
-        i
-        for i, row in enumerate(df_init.iter_rows(), 1)
-        if row[1] and re.match(r"(Fredericton|Bathurst)", row[1].title())
-    )
+    df = read_excel_from_anchor(file)
     columns = [
         "Index",
         "Municipality",
@@ -211,10 +163,6 @@ def clean_bgt_exps_data(file: Path) -> pl.DataFrame:
     ]
     columns_float = ["General Government", "Debt Costs", "Total Expenditures"]
 
-    with BytesIO() as buffer:
-        df_init.write_excel(buffer)
-        df = pl.read_excel(buffer, read_options={"skip_rows": skip}, has_header=False)
-
     df = df.select(
         col for col in df if col.drop_nulls().len() >= df.height / 10
     ).select(pl.nth(list(range(17))))
@@ -242,22 +190,8 @@ def clean_bgt_exps_data(file: Path) -> pl.DataFrame:
 
 
 # %%
-def write_clean_bgt_revs_data() -> None:
-    for file in SRC_DIR.rglob("*_bgt_revs.xlsx"):
-        dst = DST_DIR / file.relative_to(SRC_DIR)
-        dst.parent.mkdir(parents=True, exist_ok=True)
-
-        df = clean_bgt_revs_data(file)
-        df.write_excel(dst, header_format={"bold": True}, autofit=True)
-
-
 def clean_bgt_revs_data(file: Path) -> pl.DataFrame:
-    df_init = pl.read_excel(file, has_header=False)
-    skip = next(
-        i
-        for i, row in enumerate(df_init.iter_rows(), 1)
-        if row[1] and re.match(r"(Fredericton|Bathurst)", row[1].title())
-    )
+    df = read_excel_from_anchor(file)
     columns = [
         "Index",
         "Municipality",
@@ -272,10 +206,6 @@ def clean_bgt_revs_data(file: Path) -> pl.DataFrame:
         "Total Revenue",
     ]
 
-    with BytesIO() as buffer:
-        df_init.write_excel(buffer)
-        df = pl.read_excel(buffer, read_options={"skip_rows": skip}, has_header=False)
-
     df = df.select(
         col for col in df if col.drop_nulls().len() >= df.height / 10
     ).select(pl.nth(list(range(11))))
@@ -292,22 +222,8 @@ def clean_bgt_revs_data(file: Path) -> pl.DataFrame:
 
 
 # %%
-def write_clean_cmp_data() -> None:
-    for file in SRC_DIR.rglob("*_cmp_data.xlsx"):
-        dst = DST_DIR / file.relative_to(SRC_DIR)
-        dst.parent.mkdir(parents=True, exist_ok=True)
-
-        df = clean_cmp_data(file)
-        df.write_excel(dst, header_format={"bold": True}, autofit=True)
-
-
 def clean_cmp_data(file: Path) -> pl.DataFrame:
-    df_init = pl.read_excel(file, has_header=False)
-    skip = next(
-        i
-        for i, row in enumerate(df_init.iter_rows(), 1)
-        if row[1] and re.match(r"(Fredericton|Bathurst)", row[1].title())
-    )
+    df = read_excel_from_anchor(file)
     columns = [
         "Index",
         "Municipality",
@@ -343,10 +259,6 @@ def clean_cmp_data(file: Path) -> pl.DataFrame:
         "Total Budget",
     ]
 
-    with BytesIO() as buffer:
-        df_init.write_excel(buffer)
-        df = pl.read_excel(buffer, read_options={"skip_rows": skip}, has_header=False)
-
     df = df.select(
         col for col in df if col.drop_nulls().len() >= df.height / 10
     ).select(pl.nth(list(range(15))))
@@ -364,22 +276,8 @@ def clean_cmp_data(file: Path) -> pl.DataFrame:
 
 
 # %%
-def write_clean_tax_base_data() -> None:
-    for file in SRC_DIR.rglob("*_tax_base.xlsx"):
-        dst = DST_DIR / file.relative_to(SRC_DIR)
-        dst.parent.mkdir(parents=True, exist_ok=True)
-
-        df = clean_tax_base_data(file)
-        df.write_excel(dst, header_format={"bold": True}, autofit=True)
-
-
 def clean_tax_base_data(file: Path) -> pl.DataFrame:
-    df_init = pl.read_excel(file, has_header=False)
-    skip = next(
-        i
-        for i, row in enumerate(df_init.iter_rows(), 1)
-        if row[1] and re.match(r"(Fredericton|Bathurst)", row[1].title())
-    )
+    df = read_excel_from_anchor(file)
     columns = [
         "Index",
         "Municipality",
@@ -396,10 +294,6 @@ def clean_tax_base_data(file: Path) -> pl.DataFrame:
         "Total Tax Base for Rate",
     ]
 
-    with BytesIO() as buffer:
-        df_init.write_excel(buffer)
-        df = pl.read_excel(buffer, read_options={"skip_rows": skip}, has_header=False)
-
     df = df.select(
         col for col in df if col.drop_nulls().len() >= df.height / 10
     ).select(pl.nth(list(range(13))))
@@ -415,23 +309,61 @@ def clean_tax_base_data(file: Path) -> pl.DataFrame:
 
 
 def _combine_tax_base_districts(df: pl.DataFrame) -> pl.DataFrame:
-    row_iter = df.iter_rows()
-    base_idx = 0
-
-    for i, row in enumerate(row_iter):
-        if row[0] == 0:
-            for j in range(2, df.width):
-                df[base_idx, j] += row[j]
-        else:
-            base_idx = i
+    # Rows with Index 0 are sub-districts of the nearest preceding base row
+    district = (pl.col("Index") != 0).cum_sum()
 
     return (
-        df.filter(pl.col("Index") != 0)
+        df.with_columns(cs.exclude("Index", "Municipality").sum().over(district))
+        .filter(pl.col("Index") != 0)
         .drop("Index")
         .with_columns(cs.exclude("Municipality").cast(pl.Int64))
     )
 
 
+# %%
+CLEANERS = {
+    "pol_prov": clean_pol_prov_data,
+    "bgt_exps": clean_bgt_exps_data,
+    "bgt_revs": clean_bgt_revs_data,
+    "cmp_data": clean_cmp_data,
+    "tax_base": clean_tax_base_data,
+}
+
+
+def run_jobs(jobs: list[tuple[str, Path]], max_workers: int | None) -> pl.DataFrame:
+    # Workers write their own outputs and only send timings back, so at most
+    # `max_workers` workbooks are held in memory at any one time
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(write_clean_data, cat, file) for cat, file in jobs]
+
+    return pl.DataFrame(
+        [future.result() for future in futures],
+        schema={
+            "Category": pl.Utf8,
+            "File": pl.Utf8,
+            "Seconds": pl.Float64,
+            "Error": pl.Utf8,
+        },
+        orient="row",
+    )
+
+
+@suppress_fastexcel_logging
+def write_clean_data(cat: str, file: Path) -> tuple[str, str, float, str | None]:
+    start = perf_counter()
+    error = None
+
+    try:
+        df = CLEANERS[cat](file)
+        write_frame(
+            df, DST_DIR / file.relative_to(SRC_DIR), SCHEMAS_MASTER[cat], EXPORT_XLSX
+        )
+    except EXCEL_ERRORS as exc:  # Not all reader exceptions survive pickling
+        error = repr(exc)
+
+    return cat, file.relative_to(SRC_DIR).as_posix(), perf_counter() - start, error
+
+
 # %%
 if __name__ == "__main__":
     main()
@@ -7,6 +7,7 @@
 
 # %%
 from pathlib import Path
+from sys import path
 
 import polars as pl
 import polars.selectors as cs
@@ -14,9 +15,25 @@ import polars.selectors as cs
 
 # %%
 WD = Path(__file__).parent
+path.append(str(WD.parent))
+
+from storage import (  # noqa: E402
+    SCHEMAS_MASTER,
+    FrameT,
+    read_frame,
+    scan_frame,
+    write_frame,
+)
+
+
+# %%
 DATA_DIR = WD.parent.parent / "data"
 SRC_DIR = DATA_DIR / "data_clean"
 DST_DIR = DATA_DIR / "data_final"
+EXPORT_XLSX = True
+
+# Build every output as one lazy query plan, collected once at the end
+LAZY = True
 
 
 # %%
@@ -25,84 +42,6 @@ YEARS = range(2000, 2021)
 CATEGORIES = ["bgt_revs", "bgt_exps", "cmp_data", "tax_base"]
 MUNI_CAT = "cmp_data"
 
-SCHEMAS_MASTER = {
-    "bgt_exps": pl.Schema(
-        {
-            "Municipality": pl.Utf8,
-            "General Government": pl.Float64,
-            "Police": pl.Int64,
-            "Fire Protection": pl.Int64,
-            "Water Cost Transfer": pl.Int64,
-            "Emergency Measures": pl.Int64,
-            "Other Protection Services": pl.Int64,
-            "Transportation": pl.Int64,
-            "Environmental Health": pl.Int64,
-            "Public Health": pl.Int64,
-            "Environmental Development": pl.Int64,
-            "Recreation & Cultural": pl.Int64,
-            "Debt Costs": pl.Float64,
-            "Transfers": pl.Int64,
-            "Deficits": pl.Int64,
-            "Total Expenditures": pl.Float64,
-        }
-    ),
-    "bgt_revs": pl.Schema(
-        {
-            "Municipality": pl.Utf8,
-            "Warrant": pl.Int64,
-            "Unconditional Grant": pl.Int64,
-            "Services to Other Governments": pl.Int64,
-            "Sale of Services": pl.Int64,
-            "Own-Source Revenue": pl.Int64,
-            "Conditional Transfers": pl.Int64,
-            "Other Transfers": pl.Int64,
-            "Biennial Surplus": pl.Int64,
-            "Total Revenue": pl.Int64,
-        }
-    ),
-    "cmp_data": pl.Schema(
-        {
-            "Municipality": pl.Utf8,
-            "Latest Census Population": pl.Int64,
-            "Penultimate Census Population": pl.Int64,
-            "Provincial Kilometrage": pl.Float64,
-            "Regional Kilometrage": pl.Float64,
-            "Municipal Kilometrage": pl.Float64,
-            "Total Kilometrage": pl.Float64,
-            "Population/Kilometrage": pl.Float64,
-            "Tax Base": pl.Int64,
-            "Tax Base/Capita": pl.Float64,
-            "Tax Base/Kilometrage": pl.Float64,
-            "Total Budget": pl.Int64,
-            "Fiscal Capacity": pl.Float64,
-            "Average Tax Rate": pl.Float64,
-        }
-    ),
-    "tax_base": pl.Schema(
-        {
-            "Municipality": pl.Utf8,
-            "General Residential Assessment": pl.Int64,
-            "Federal Residential Assessment": pl.Int64,
-            "Provincial Residential Assessment": pl.Int64,
-            "Total Residential Assessment": pl.Int64,
-            "General Non-Residential Assessment": pl.Int64,
-            "Federal Non-Residential Assessment": pl.Int64,
-            "Provincial Non-Residential Assessment": pl.Int64,
-            "Total Non-Residential Assessment": pl.Int64,
-            "Total Municipal Assessment Base": pl.Int64,
-            "Total Municipal Tax Base": pl.Int64,
-            "Total Tax Base for Rate": pl.Int64,
-        }
-    ),
-    "pol_prov": pl.Schema(
-        {
-            "District": pl.Utf8,
-            "Municipality": pl.Utf8,
-            "Policing Provider": pl.Utf8,
-        }
-    ),
-}
-
 COLUMNS_MASTER = [
     "Year",
     "Municipality",
@@ -150,6 +89,7 @@ MAPS_MASTER = {
 # %%
 COMBINE_COLS = ("Year", "Municipality")
 MUNIS_COMBINE = {"Florenceville-Bristol": ["Florenceville", "Bristol"]}
+PROVIDER_ALIASES = {"Sussex Corner": "Sussex"}
 FIELDS_CONSTANT = ["Year", "Municipality"]
 FIELDS_DROPPED = [("cmp_data", "Fiscal Capacity")]
 FIELDS_WEIGHTED = {
@@ -168,40 +108,82 @@ FIELDS_RECOMPUTED = {
 
 # %%
 def main() -> None:
-    dfs_final = convert_clean_to_final()
-    df_master = convert_final_to_master(dfs_final)
+    dfs_final, df_problems = convert_clean_to_final()
+    df_master, muni_lists = convert_final_to_master(dfs_final)
+
+    # The outputs and the frames validating them share a single query plan
+    if LAZY:
+        collected = pl.collect_all(
+            [*dfs_final.values(), df_master, df_problems, *muni_lists]
+        )
+        dfs_final = dict(zip(dfs_final, collected))
+        df_master, df_problems, *muni_lists = collected[len(dfs_final) :]
 
-    DST_DIR.mkdir(parents=True, exist_ok=True)
+    check_pol_prov_problems(df_problems)
+    check_muni_lists(muni_lists)
 
     for cat, df in dfs_final.items():
-        dst = DST_DIR / f"data_{cat}.xlsx"
-        df.write_excel(dst, header_format={"bold": True}, autofit=True)
+        write_frame(df, DST_DIR / f"data_{cat}", get_final_schema(cat), EXPORT_XLSX)
 
-    dst_master = DST_DIR / "data_master.xlsx"
-    df_master.write_excel(dst_master, header_format={"bold": True}, autofit=True)
+    write_frame(df_master, DST_DIR / "data_master", export_xlsx=EXPORT_XLSX)
+
+
+def get_final_schema(cat: str) -> pl.Schema:
+    if cat == "pol_prov":
+        return pl.Schema(
+            (name, dtype)
+            for name, dtype in SCHEMAS_MASTER[cat].items()
+            if name != "District"
+        )
+
+    return pl.Schema(
+        [("Year", pl.UInt32)]
+        + [
+            (name, dtype)
+            for name, dtype in SCHEMAS_MASTER[cat].items()
+            if (cat, name) not in FIELDS_DROPPED
+        ]
+    )
 
 
 # %%
-def convert_clean_to_final() -> dict[str, pl.DataFrame]:
+def convert_clean_to_final() -> (
+    tuple[dict[str, pl.DataFrame], pl.DataFrame]
+    | tuple[dict[str, pl.LazyFrame], pl.LazyFrame]
+):
     dfs_concat = concat_panels_by_cat()
+
+    # Each panel feeds several branches of the plan, which polars does not reliably
+    # share on its own when they are collected together
+    if LAZY:
+        dfs_concat = {cat: df.cache() for cat, df in dfs_concat.items()}
+
     dfs_combined = combine_munis_all(dfs_concat)
 
-    muni_list = dfs_combined[MUNI_CAT].to_series(1).unique()
-    df_pol_prov = melt_pol_prov_data(muni_list)
+    if LAZY:
+        dfs_combined = {cat: df.cache() for cat, df in dfs_combined.items()}
 
-    return dfs_combined | {"pol_prov": df_pol_prov}
+    df_pol_prov, df_problems = melt_pol_prov_data(
+        dfs_combined[MUNI_CAT].select(pl.col("Municipality").unique())
+    )
 
+    return dfs_combined | {"pol_prov": df_pol_prov}, df_problems
 
-def concat_panels_by_cat() -> dict[str, pl.DataFrame]:
+
+def concat_panels_by_cat() -> dict[str, pl.DataFrame] | dict[str, pl.LazyFrame]:
     src_year_dirs = {year: SRC_DIR / str(year) for year in YEARS}
     files = {
-        cat: {year: next(src_year_dirs[year].glob(f"*_{cat}.xlsx")) for year in YEARS}
+        cat: {
+            year: next(src_year_dirs[year].glob(f"*_{cat}.parquet")) for year in YEARS
+        }
         for cat in CATEGORIES
     }
 
+    read = scan_frame if LAZY else read_frame
+
     return {
         cat: pl.concat(
-            pl.read_excel(source, schema_overrides=SCHEMAS_MASTER[cat])
+            read(source, SCHEMAS_MASTER[cat])
             .with_columns(pl.lit(year, pl.UInt32).alias("Year"))
             .select("Year", cs.exclude("Year"))
             for year, source in files[cat].items()
@@ -210,102 +192,59 @@ def concat_panels_by_cat() -> dict[str, pl.DataFrame]:
     }
 
 
-def combine_munis_all(dfs: dict[str, pl.DataFrame]) -> dict[str, pl.DataFrame]:
+def combine_munis_all(dfs: dict[str, FrameT]) -> dict[str, FrameT]:
+    targets = get_combine_targets()
+    mask = pl.col(COMBINE_COLS[1]).is_in(list(targets))
     dfs_combined = {}
 
     for cat in CATEGORIES:
-        df = dfs[cat].clone()
-        needs_cross_weight = {}
+        df = dfs[cat].with_row_index("_original_index")
+        schema = df.collect_schema()
+        to_combine = df.filter(mask)
+        weights = {}
 
         for (field_cat, field_name), (
             weight_cat,
             weight_name,
         ) in FIELDS_WEIGHTED.items():
-            if field_cat == cat and weight_cat != cat:
-                needs_cross_weight[field_name] = (weight_cat, weight_name)
-
-        temp_weight_cols = {}
-
-        for field_name, (weight_cat, weight_name) in needs_cross_weight.items():
-            temp_col_name = f"_temp_weight_{field_name}"
-            temp_weight_cols[field_name] = temp_col_name
-
-            df = df.join(
-                dfs[weight_cat].select(list(COMBINE_COLS) + [weight_name]),
-                list(COMBINE_COLS),
-                "left",
-            ).rename({weight_name: temp_col_name})
+            if field_cat != cat:
+                continue
 
-        for target_muni, source_munis in MUNIS_COMBINE.items():
-            df = df.with_row_index("_original_index")
-            mask = pl.col(COMBINE_COLS[1]).is_in(source_munis)
-            to_combine = df.filter(mask)
-            to_keep = df.filter(~mask)
-
-            if to_combine.height == 0:
-                df = df.drop("_original_index")
+            if weight_cat == cat:
+                weights[field_name] = weight_name
             else:
-                group_cols = [col for col in COMBINE_COLS if col != COMBINE_COLS[1]]
-                agg_exprs = []
-
-                for col_name in df.columns:
-                    if col_name not in list(temp_weight_cols.values()) + group_cols:
-                        if col_name == "_original_index":
-                            agg_exprs.append(
-                                pl.col("_original_index").min().alias("_original_index")
-                            )
-                        elif col_name in FIELDS_CONSTANT:
-                            if col_name == COMBINE_COLS[1]:
-                                agg_exprs.append(pl.lit(target_muni).alias(col_name))
-                            else:
-                                agg_exprs.append(
-                                    pl.col(col_name).first().alias(col_name)
-                                )
-                        elif (cat, col_name) in FIELDS_WEIGHTED:
-                            weight_cat, weight_col = FIELDS_WEIGHTED[(cat, col_name)]
-
-                            if weight_cat == cat:
-                                agg_exprs.append(
-                                    (
-                                        (pl.col(col_name) * pl.col(weight_col)).sum()
-                                        / pl.col(weight_col).sum()
-                                    ).alias(col_name)
-                                )
-                            else:
-                                temp_col_name = temp_weight_cols[col_name]
-
-                                agg_exprs.append(
-                                    (
-                                        (pl.col(col_name) * pl.col(temp_col_name)).sum()
-                                        / pl.col(temp_col_name).sum()
-                                    ).alias(col_name)
-                                )
-                        else:
-                            if df.schema[col_name].is_numeric():
-                                agg_exprs.append(pl.col(col_name).sum().alias(col_name))
-                            else:
-                                agg_exprs.append(
-                                    pl.col(col_name).first().alias(col_name)
-                                )
-
-                final_cols = [
-                    col for col in df.columns if col not in temp_weight_cols.values()
-                ]
-
-                to_keep = to_keep.select(final_cols)
-
-                combined = (
-                    to_combine.group_by(group_cols).agg(agg_exprs).select(final_cols)
+                weights[field_name] = f"_temp_weight_{field_name}"
+                to_combine = to_combine.join(
+                    dfs[weight_cat].select(
+                        *COMBINE_COLS, pl.col(weight_name).alias(weights[field_name])
+                    ),
+                    list(COMBINE_COLS),
+                    "left",
+                    maintain_order="left",
                 )
 
-                df = (
-                    pl.concat([to_keep, combined])
-                    .sort("_original_index")
-                    .drop("_original_index")
-                )
+        agg_exprs = [pl.col("_original_index").min()] + [
+            get_combine_expr(col_name, dtype, weights.get(col_name))
+            for col_name, dtype in schema.items()
+            if col_name not in COMBINE_COLS and col_name != "_original_index"
+        ]
+
+        # Every source municipality is renamed to its target up front, so a single
+        # group_by handles all combinations regardless of the size of MUNIS_COMBINE
+        combined = (
+            to_combine.with_columns(pl.col(COMBINE_COLS[1]).replace_strict(targets))
+            .group_by(list(COMBINE_COLS))
+            .agg(agg_exprs)
+            .select(schema.names())
+        )
+        df = (
+            pl.concat([df.filter(~mask), combined])
+            .sort("_original_index")
+            .drop("_original_index")
+        )
 
         for field_cat, field_name in FIELDS_DROPPED:
-            if field_cat == cat and field_name in df.columns:
+            if field_cat == cat and field_name in schema:
                 df = df.drop(field_name)
 
         dfs_combined[cat] = df
@@ -322,11 +261,13 @@ def combine_munis_all(dfs: dict[str, pl.DataFrame]) -> dict[str, pl.DataFrame]:
                     dfs_combined[src_cat1].select(list(COMBINE_COLS) + [src_field1]),
                     list(COMBINE_COLS),
                     "left",
+                    maintain_order="left",
                 )
                 .join(
                     dfs_combined[src_cat2].select(list(COMBINE_COLS) + [src_field2]),
                     list(COMBINE_COLS),
                     "left",
+                    maintain_order="left",
                 )
                 .with_columns(
                     func(pl.col(src_field1), pl.col(src_field2)).alias(target_field)
@@ -337,76 +278,150 @@ def combine_munis_all(dfs: dict[str, pl.DataFrame]) -> dict[str, pl.DataFrame]:
     return dfs_combined
 
 
-def melt_pol_prov_data(muni_list: pl.Series) -> pl.DataFrame:
-    src_pol_prov = next(SRC_DIR.glob("*_pol_prov.xlsx"))
-    df = pl.read_excel(src_pol_prov, schema_overrides=SCHEMAS_MASTER["pol_prov"])
-    prov_map = {}
-
-    for dist in df.select("District").to_series().unique():
-        if dist in muni_list:
-            providers = df.filter(pl.col("District") == dist).to_series(2).unique()
+def get_combine_targets() -> dict[str, str]:
+    targets = {}
 
-            if len(providers) > 1:
+    for target, sources in MUNIS_COMBINE.items():
+        for source in sources:
+            if source in targets:
                 raise ValueError(
-                    f"District {dist} has multiple policing providers: {providers}"
+                    f"{source} is combined into both {targets[source]} and {target}."
                 )
 
-            prov_map[dist] = providers[0]
+            targets[source] = target
 
-    for muni in df.select("Municipality").to_series().unique():
-        if muni in muni_list:
-            providers = df.filter(pl.col("Municipality") == muni).to_series(2).unique()
+    # A target may itself be combined further, so chains are followed to the end
+    for source, target in targets.items():
+        seen = {source}
 
-            if len(providers) > 1:
-                raise RuntimeError(
-                    f"Municipality {muni} has multiple policing providers: {providers}"
-                )
+        while target in targets:
+            if target in seen:
+                raise ValueError(f"Cyclic combination involving {source}.")
 
-            if muni in prov_map and prov_map[muni] != providers[0]:
-                raise RuntimeError(
-                    f"Municipality {muni} has different policing providers: "
-                    f"{prov_map[muni]} and {providers[0]}"
-                )
+            seen.add(target)
+            target = targets[target]
 
-            prov_map[muni] = providers[0]
+        targets[source] = target
 
-    prov_map["Sussex Corner"] = prov_map["Sussex"]
-    missing_munis = set(muni_list) - prov_map.keys()
+    return targets
 
-    if missing_munis:
-        raise RuntimeError(
-            "Missing policing provider data for the following "
-            f"municipalities: {missing_munis}"
-        )
 
-    muni_data, prov_data = zip(*prov_map.items())
+def get_combine_expr(
+    col_name: str, dtype: pl.DataType, weight_name: str | None
+) -> pl.Expr:
+    if col_name in FIELDS_CONSTANT:
+        return pl.col(col_name).first()
 
-    return pl.DataFrame(
+    if weight_name is not None:
+        return (
+            (pl.col(col_name) * pl.col(weight_name)).sum() / pl.col(weight_name).sum()
+        ).alias(col_name)
+
+    if dtype.is_numeric():
+        return pl.col(col_name).sum()
+
+    return pl.col(col_name).first()
+
+
+def melt_pol_prov_data(df_munis: FrameT) -> tuple[FrameT, FrameT]:
+    src_pol_prov = next(SRC_DIR.glob("*_pol_prov.parquet"))
+    df = scan_frame(src_pol_prov, SCHEMAS_MASTER["pol_prov"])
+    df_munis = df_munis.lazy()
+
+    df_providers = (
+        pl.concat(
+            df.select(
+                pl.col(key).alias("Municipality"),
+                "Policing Provider",
+                pl.lit(key).alias("Key"),
+            )
+            for key in ("District", "Municipality")
+        )
+        .join(df_munis, "Municipality", "semi")
+        .group_by("Municipality")
+        .agg(pl.col("Policing Provider", "Key").unique().sort())
+    )
+    df_aliases = pl.LazyFrame(
         {
-            "Municipality": muni_data,
-            "Policing Provider": prov_data,
+            "Municipality": list(PROVIDER_ALIASES),
+            "Source": list(PROVIDER_ALIASES.values()),
         }
-    ).sort("Municipality")
+    )
+    df_resolved = df_providers.select(
+        "Municipality", pl.col("Policing Provider").list.first()
+    ).filter(~pl.col("Municipality").is_in(list(PROVIDER_ALIASES)))
+    df_resolved = pl.concat(
+        [
+            df_resolved,
+            df_aliases.join(
+                df_resolved, left_on="Source", right_on="Municipality"
+            ).select("Municipality", "Policing Provider"),
+        ]
+    )
+
+    # Problems are only reported once the plan has been collected
+    df_problems = pl.concat(
+        [
+            df_providers.filter(pl.col("Policing Provider").list.len() > 1)
+            .sort("Municipality")
+            .select(
+                pl.format(
+                    "  - {} has multiple policing providers (by {}): {}",
+                    "Municipality",
+                    pl.col("Key").list.join("/"),
+                    pl.col("Policing Provider").list.join(", "),
+                ).alias("Problem")
+            ),
+            df_munis.join(df_resolved, "Municipality", "anti")
+            .sort("Municipality")
+            .select(
+                pl.format("  - {} has no policing provider data", "Municipality").alias(
+                    "Problem"
+                )
+            ),
+        ]
+    )
+    df_resolved = df_resolved.sort("Municipality")
+
+    if LAZY:
+        return df_resolved, df_problems
+
+    return tuple(pl.collect_all([df_resolved, df_problems]))
+
+
+def check_pol_prov_problems(df_problems: pl.DataFrame) -> None:
+    if not df_problems.is_empty():
+        raise ValueError(
+            "Failed to resolve policing providers:\n"
+            + "\n".join(df_problems.to_series())
+        )
 
 
 # %%
-def convert_final_to_master(dfs_final: dict[str, pl.DataFrame]) -> pl.DataFrame:
+def convert_final_to_master(
+    dfs_final: dict[str, FrameT],
+) -> tuple[FrameT, list[FrameT]]:
     dfs_inter = {
         cat: dfs_final[cat].select(MAPS_MASTER[cat].keys()).rename(MAPS_MASTER[cat])
         for cat in CATEGORIES
     }
+    muni_lists = [
+        dfs_inter[cat].select(pl.col("Municipality").unique()) for cat in CATEGORIES
+    ]
     df_master = dfs_inter[CATEGORIES[0]]
-    muni_list = set(df_master.to_series(1))
-
-    if any(set(dfs_inter[cat].to_series(1)) != muni_list for cat in CATEGORIES[1:]):
-        raise RuntimeError("Municipalities are not the same across datasets.")
 
     for cat in CATEGORIES[1:]:
-        df_master = df_master.join(dfs_inter[cat], ["Year", "Municipality"])
+        df_master = df_master.join(
+            dfs_inter[cat], ["Year", "Municipality"], maintain_order="left"
+        )
 
-    prov_map = dict(zip(*dfs_final["pol_prov"]))
+    providers = [
+        col.removeprefix("Provider_")
+        for col in COLUMNS_MASTER
+        if col.startswith("Provider_")
+    ]
 
-    return (
+    df_master = (
         df_master.with_columns(pl.col(COLUMNS_SCALE) * SCALE_FACTOR)
         .with_columns(
             (pl.col("TaxBase") / pl.col("LatestCensusPop")).alias("TaxBaseCapita")
@@ -424,12 +439,23 @@ def convert_final_to_master(dfs_final: dict[str, pl.DataFrame]) -> pl.DataFrame:
                 "OtherRevCapita"
             )
         )
-        .with_columns(pl.col("Municipality").replace(prov_map).alias("Provider"))
-        .to_dummies("Provider")
-        .with_columns(cs.matches("Provider_*").cast(pl.Boolean))
+        .join(dfs_final["pol_prov"], "Municipality", "left", maintain_order="left")
+        .with_columns(
+            (pl.col("Policing Provider") == provider).alias(f"Provider_{provider}")
+            for provider in providers
+        )
         .select(COLUMNS_MASTER)
     )
 
+    return df_master, muni_lists
+
+
+def check_muni_lists(muni_lists: list[pl.DataFrame]) -> None:
+    muni_list = set(muni_lists[0].to_series())
+
+    if any(set(munis.to_series()) != muni_list for munis in muni_lists[1:]):
+        raise RuntimeError("Municipalities are not the same across datasets.")
+
 
 # %%
 if __name__ == "__main__":
@@ -6,69 +6,59 @@
 
 
 # %%
-from io import BytesIO
 from pathlib import Path
 
 import polars as pl
 
-from openpyxl import load_workbook
-
 
 # %%
 WD = Path(__file__).parent
 DATA_DIR = WD.parent.parent / "data"
 SRC_DIR = DATA_DIR / "data_final"
-SRC = SRC_DIR / "data_master.xlsx"
+SRC = SRC_DIR / "data_master.parquet"
 DST_DIR = DATA_DIR
 DST = DST_DIR / "inconsistent_munis.xlsx"
 
+# Excel column widths in pixels for the default font
+CHAR_WIDTH_PX = 7
+PADDING_PX = 5
+
 
 # %%
 def main() -> None:
-    df = pl.read_excel(SRC).select(["Year", "Municipality"])
-    inconsistent_munis = (
+    df = pl.read_parquet(SRC, columns=["Year", "Municipality"]).with_columns(
+        pl.col("Year").cast(pl.Int64)
+    )
+    years_all = df.select(
+        pl.int_range(pl.col("Year").min(), pl.col("Year").max() + 1).alias("Year")
+    )
+
+    df_inconsistent = (
         df.group_by("Municipality")
         .agg(pl.col("Year").n_unique().alias("YearCount"))
         .filter(pl.col("YearCount") < df.select("Year").n_unique())
         .select("Municipality")
-        .to_series()
-        .to_list()
-    )
-
-    year_min = df.select(pl.col("Year").min()).item()
-    year_max = df.select(pl.col("Year").max()).item()
-    years_all = set(range(year_min, year_max + 1))
-
-    df_inconsistent = (
-        df.filter(pl.col("Municipality").is_in(inconsistent_munis))
+        .join(years_all, how="cross")
+        .join(df, ["Municipality", "Year"], "anti")
         .group_by("Municipality")
-        .agg([pl.col("Year")])
-        .with_columns(
-            pl.col("Year")
-            .map_elements(
-                lambda years: sorted(years_all - set(years)),
-                pl.List(pl.Int64),
-            )
-            .alias("MissingYears")
-        )
-        .select(["Municipality", "MissingYears"])
+        .agg(pl.col("Year").sort().alias("MissingYears"))
         .sort("Municipality")
     )
 
-    with BytesIO() as buffer:
-        df_inconsistent.write_excel(buffer)
-        wb = load_workbook(buffer)
-
-    ws = wb.active
-
-    for column_cells in ws.columns:
-        max_length = max(
-            len(str(cell.value)) if cell.value is not None else 0
-            for cell in column_cells
-        )
-        ws.column_dimensions[column_cells[0].column_letter].width = max_length
-
-    wb.save(DST)
+    df_report = df_inconsistent.with_columns(
+        pl.format(
+            "[{}]", pl.col("MissingYears").cast(pl.List(pl.Utf8)).list.join(", ")
+        ).alias("MissingYears")
+    )
+    widths = df_report.select(pl.all().str.len_chars().max()).row(0, named=True)
+
+    df_report.write_excel(
+        DST,
+        column_widths={
+            name: max(len(name), width) * CHAR_WIDTH_PX + PADDING_PX
+            for name, width in widths.items()
+        },
+    )
 
 
 # %%
@@ -0,0 +1,144 @@
+# Copyright 2025 Craig Brett and Luis M. B. Varona
+#
+# Licensed under the MIT license <LICENSE or
+# http://opensource.org/licenses/MIT>. This file may not be copied, modified, or
+# distributed except according to those terms.
+
+
+# %%
+import re
+from collections.abc import Callable
+
+import polars as pl
+
+
+# %%
+MUNI_ALIASES = {
+    "Aroostock": "Aroostook",
+    "Baker Brook": "Baker-Brook",
+    "Grande Anse": "Grande-Anse",
+    "Grand Bay/Westfield": "Grand Bay-Westfield",
+    "Grand-Falls/Grand-Sault": "Grand Falls/Grand-Sault",
+    "Grand-Sault/Grand Falls": "Grand Falls/Grand-Sault",
+    "Grand-Sault/Grand-Falls": "Grand Falls/Grand-Sault",
+    "Lameque": "Lamèque",
+    "Mcadam": "McAdam",
+    "Neguac": "Néguac",
+    "Saint-Francois-de-Madawaska": "Saint-François-de-Madawaska",
+    "Saint-Louis de Kent": "Saint-Louis-de-Kent",
+    "Sainte-Marie-Saint-Raphael": "Sainte-Marie-Saint-Raphaël",
+    "Sainte-Marie-Saint-Raphaêl": "Sainte-Marie-Saint-Raphaël",
+    "Shédiac": "Shediac",
+    "St-Hilaire": "Saint-Hilaire",
+    "St-Isidore": "Saint-Isidore",
+    "St. Andrews": "Saint Andrews",
+    "St. André": "Saint-André",
+    "St. George": "Saint George",
+    "St. Hilaire": "Saint-Hilaire",
+    "St. Léonard": "Saint-Léonard",
+    "Ste-Anne-de-Madawaska": "Sainte-Anne-de-Madawaska",
+    "Town Of Rothesay": "Rothesay",
+    "Town of Rothesay": "Rothesay",
+    "Lac-Baker": "Lac Baker",
+    "Village de Lac Baker": "Lac Baker",
+    "Village de Lac-Baker": "Lac Baker",
+}
+
+POL_PROV_DISTRICT_ALIASES = {
+    "Baker Brook": "Baker-Brook",
+    "Cambridge Narrows": "Cambridge-Narrows",
+    "Plaster Rocker": "Plaster Rock",
+    "Saint-Anne": "Sainte-Anne-de-Madawaska",
+    "Saint-François": "Saint-François-de-Madawaska",
+    "Ste-Marie-St-Raphael": "Sainte-Marie-Saint-Raphaël",
+    "Tracadie": "Tracadie-Sheila",
+}
+
+POL_PROV_MUNI_ALIASES = {
+    "Tracadie": "Tracadie-Sheila",
+}
+
+# Anchored patterns substituted in order for names without an exact alias
+POL_PROV_DISTRICT_PATTERNS = {
+    r"^Neguac": "Néguac",
+    r"^Eel Riv.*": "Eel River Crossing",
+    r"^Grand-Sault.*": "Grand Falls/Grand-Sault",
+    r"^Nackawic.*": "Nackawic",
+}
+
+POL_PROV_MUNI_PATTERNS = {
+    r"^Grand-Sault.*": "Grand Falls/Grand-Sault",
+    r"^Nackawic.*": "Nackawic",
+}
+
+
+# %%
+def normalize_muni(expr: pl.Expr) -> pl.Expr:
+    return (
+        expr.str.to_titlecase()
+        .str.replace_all(r"\s[-\(].*", "")
+        .str.strip_chars()
+        .str.replace_all(r"\n\s*", "")
+        .str.replace_all(r"_X000(D|d)_", "")
+        .str.replace_all(r"\\", "/")
+        .str.replace_all(r"\s*/\s*", "/")
+        .str.replace_all(r"-\s*", "-")
+        .str.replace_all(" De ", " de ")
+        .str.replace_all("-De-", "-de-")
+    )
+
+
+def normalize_pol_prov_district(expr: pl.Expr) -> pl.Expr:
+    return expr.str.replace(r"\s(C|TV|V)$", "")
+
+
+def normalize_pol_prov_muni(expr: pl.Expr) -> pl.Expr:
+    return expr
+
+
+PROFILES: dict[
+    str, tuple[Callable[[pl.Expr], pl.Expr], dict[str, str], dict[str, str]]
+] = {
+    "muni": (normalize_muni, MUNI_ALIASES, {}),
+    "pol_prov_district": (
+        normalize_pol_prov_district,
+        POL_PROV_DISTRICT_ALIASES,
+        POL_PROV_DISTRICT_PATTERNS,
+    ),
+    "pol_prov_muni": (
+        normalize_pol_prov_muni,
+        POL_PROV_MUNI_ALIASES,
+        POL_PROV_MUNI_PATTERNS,
+    ),
+}
+
+# Raw spelling -> canonical name, kept for the lifetime of the process
+_CACHES: dict[str, dict[str, str]] = {profile: {} for profile in PROFILES}
+
+
+# %%
+def canonicalize(names: pl.Series, profile: str) -> pl.Series:
+    normalize, aliases, patterns = PROFILES[profile]
+    cache = _CACHES[profile]
+
+    uniques = names.drop_nulls().unique()
+    misses = uniques.filter(~uniques.is_in(list(cache)))
+
+    if not misses.is_empty():
+        normalized = misses.to_frame().select(normalize(pl.first())).to_series()
+        cache.update(
+            (raw, resolve_alias(name, aliases, patterns))
+            for raw, name in zip(misses, normalized)
+        )
+
+    return names.replace_strict(cache, return_dtype=pl.String)
+
+
+def resolve_alias(name: str, aliases: dict[str, str], patterns: dict[str, str]) -> str:
+    if name in aliases:
+        return aliases[name]
+
+    for pattern, repl in patterns.items():
+        name = re.sub(pattern, repl, name, count=1)
+
+    return name
@@ -0,0 +1,149 @@
+# Copyright 2025 Craig Brett and Luis M. B. Varona
+#
+# Licensed under the MIT license <LICENSE or
+# http://opensource.org/licenses/MIT>. This file may not be copied, modified, or
+# distributed except according to those terms.
+
+
+# %%
+from pathlib import Path
+from typing import TypeVar
+
+import polars as pl
+
+
+# %%
+SUFFIX = ".parquet"
+SUFFIX_EXPORT = ".xlsx"
+
+FrameT = TypeVar("FrameT", pl.DataFrame, pl.LazyFrame)
+
+SCHEMAS_MASTER = {
+    "bgt_exps": pl.Schema(
+        {
+            "Municipality": pl.Utf8,
+            "General Government": pl.Float64,
+            "Police": pl.Int64,
+            "Fire Protection": pl.Int64,
+            "Water Cost Transfer": pl.Int64,
+            "Emergency Measures": pl.Int64,
+            "Other Protection Services": pl.Int64,
+            "Transportation": pl.Int64,
+            "Environmental Health": pl.Int64,
+            "Public Health": pl.Int64,
+            "Environmental Development": pl.Int64,
+            "Recreation & Cultural": pl.Int64,
+            "Debt Costs": pl.Float64,
+            "Transfers": pl.Int64,
+            "Deficits": pl.Int64,
+            "Total Expenditures": pl.Float64,
+        }
+    ),
+    "bgt_revs": pl.Schema(
+        {
+            "Municipality": pl.Utf8,
+            "Warrant": pl.Int64,
+            "Unconditional Grant": pl.Int64,
+            "Services to Other Governments": pl.Int64,
+            "Sale of Services": pl.Int64,
+            "Own-Source Revenue": pl.Int64,
+            "Conditional Transfers": pl.Int64,
+            "Other Transfers": pl.Int64,
+            "Biennial Surplus": pl.Int64,
+            "Total Revenue": pl.Int64,
+        }
+    ),
+    "cmp_data": pl.Schema(
+        {
+            "Municipality": pl.Utf8,
+            "Latest Census Population": pl.Int64,
+            "Penultimate Census Population": pl.Int64,
+            "Provincial Kilometrage": pl.Float64,
+            "Regional Kilometrage": pl.Float64,
+            "Municipal Kilometrage": pl.Float64,
+            "Total Kilometrage": pl.Float64,
+            "Population/Kilometrage": pl.Float64,
+            "Tax Base": pl.Int64,
+            "Tax Base/Capita": pl.Float64,
+            "Tax Base/Kilometrage": pl.Float64,
+            "Total Budget": pl.Int64,
+            "Fiscal Capacity": pl.Float64,
+            "Average Tax Rate": pl.Float64,
+        }
+    ),
+    "tax_base": pl.Schema(
+        {
+            "Municipality": pl.Utf8,
+            "General Residential Assessment": pl.Int64,
+            "Federal Residential Assessment": pl.Int64,
+            "Provincial Residential Assessment": pl.Int64,
+            "Total Residential Assessment": pl.Int64,
+            "General Non-Residential Assessment": pl.Int64,
+            "Federal Non-Residential Assessment": pl.Int64,
+            "Provincial Non-Residential Assessment": pl.Int64,
+            "Total Non-Residential Assessment": pl.Int64,
+            "Total Municipal Assessment Base": pl.Int64,
+            "Total Municipal Tax Base": pl.Int64,
+            "Total Tax Base for Rate": pl.Int64,
+        }
+    ),
+    "pol_prov": pl.Schema(
+        {
+            "District": pl.Utf8,
+            "Municipality": pl.Utf8,
+            "Policing Provider": pl.Utf8,
+        }
+    ),
+}
+
+
+# %%
+def write_frame(
+    df: pl.DataFrame,
+    dst: Path,
+    schema: pl.Schema | None = None,
+    export_xlsx: bool = False,
+) -> None:
+    if schema is not None:
+        df = apply_schema(df, schema)
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    df.write_parquet(dst.with_suffix(SUFFIX))
+
+    if export_xlsx:
+        df.write_excel(
+            dst.with_suffix(SUFFIX_EXPORT), header_format={"bold": True}, autofit=True
+        )
+
+
+def read_frame(
+    src: Path, schema: pl.Schema | None = None, columns: list[str] | None = None
+) -> pl.DataFrame:
+    df = pl.read_parquet(src.with_suffix(SUFFIX), columns=columns)
+
+    if schema is not None:
+        df = apply_schema(df, schema, columns)
+
+    return df
+
+
+def scan_frame(
+    src: Path, schema: pl.Schema | None = None, columns: list[str] | None = None
+) -> pl.LazyFrame:
+    lf = pl.scan_parquet(src.with_suffix(SUFFIX))
+
+    if columns is not None:
+        lf = lf.select(columns)
+
+    if schema is not None:
+        lf = apply_schema(lf, schema, columns)
+
+    return lf
+
+
+def apply_schema(
+    df: FrameT, schema: pl.Schema, columns: list[str] | None = None
+) -> FrameT:
+    names = schema.names() if columns is None else columns
+
+    return df.select(pl.col(name).cast(schema[name]) for name in names)
@@ -8,11 +8,22 @@
 # %%
 import logging
 
+from functools import wraps
 from typing import Callable
 
+from fastexcel import FastExcelError
+from polars.exceptions import PolarsError
+from xlrd import XLRDError
+
+
+# %%
+# Failures raised while reading, converting or writing a single workbook
+EXCEL_ERRORS = (OSError, ValueError, FastExcelError, PolarsError, XLRDError)
+
 
 # %%
 def suppress_fastexcel_logging(func: Callable) -> Callable:
+    @wraps(func)
     def wrapper(*args, **kwargs):
         logger = logging.getLogger("fastexcel.types.dtype")
         default_level = logger.getEffectiveLevel()